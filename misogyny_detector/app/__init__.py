@@ -5,6 +5,10 @@ from flask import Flask
 def create_app():
     app = Flask(__name__)
 
+    # 請求結束時歸還資料庫連線
+    from app.models import db
+    db.init_app(app)
+
     # 註冊藍圖
     from app.controllers.main import main_bp
     app.register_blueprint(main_bp)
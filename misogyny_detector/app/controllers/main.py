@@ -1,37 +1,188 @@
-from flask import Blueprint, render_template, request
-from app.threads.crawler import scrape_profile
-from app.models.detector import load_model, connect_to_db, close_db_connection, process_posts , get_post_stats_and_misogynistic_texts
+from flask import Blueprint, Response, render_template, stream_template, request, jsonify, redirect, url_for
+from app.models.detector import (
+    start_model_loading, model_ready, model_status, get_misogynistic_texts_page, prediction_cache_stats, stats_cache,
+    FLAGGED_ORDERS, FLAGGED_PAGE_SIZE, FLAGGED_MAX_PAGE_SIZE
+)
+from app.models.db import db_pool, get_db
+from app.jobs.manager import enqueue_job, get_job, start_workers, dispatcher_ready, dispatcher_status, STATUS_DONE
 from dotenv import load_dotenv
 load_dotenv()
 
 main_bp = Blueprint('main', __name__)
 
-# 啟動時載入 BERT 模型與資料庫連線
-load_model()
+# 啟動時在背景載入 BERT 模型（不阻塞 worker 啟動），並啟動背景分析 worker
+start_model_loading()
+start_workers()
+
+def _normalize_username(value):
+    """
+    表單與 JSON API 共用：去掉前後空白與開頭的 @（使用者常直接貼上 @帳號）
+    """
+    return (value or '').strip().lstrip('@')
+
+def _job_links(job):
+    return {
+        "status_url": url_for('main.job_status', job_id=job['id']),
+        "result_url": url_for('main.job_result', job_id=job['id']),
+        "flagged_url": url_for('main.flagged_texts', username=job['username']) if job['status'] == STATUS_DONE else None,
+    }
+
+def _model_failed():
+    """
+    模型載入失敗時拒絕新的分析請求，並觸發重新載入；載入中的請求照常排隊
+    """
+    if model_status['state'] != 'failed':
+        return False
+    start_model_loading()
+    return True
+
+@main_bp.route('/healthz', methods=['GET'])
+def healthz():
+    # 只要程序活著就回 200；模型狀態另外列出
+    return jsonify({"status": "ok", "model": model_status['state']})
+
+@main_bp.route('/readyz', methods=['GET'])
+def readyz():
+    # 模型載入完成且工作分派正在執行才算就緒；分派停止時排隊的工作不會被處理
+    ready = model_ready() and dispatcher_ready()
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "model": model_status['state'],
+        "error": model_status['error'],
+        "loaded_at": model_status['loaded_at'],
+        "dispatcher": dispatcher_status,
+    }), 200 if ready else 503
+
+class _FlaggedPage:
+    """
+    結果頁的第一頁厭女文：串流輸出到列表時才查詢資料庫，查完後 next_cursor 才有值
+    """
+
+    def __init__(self, username, order):
+        self.username = username
+        self.order = order
+        self.next_cursor = None
+
+    def __iter__(self):
+        items, self.next_cursor = get_misogynistic_texts_page(get_db(), self.username, self.order)
+        return iter(items)
+
+@main_bp.route('/metrics/db', methods=['GET'])
+def db_metrics():
+    # 連線池大小、取得連線的等待時間與借出時間
+    return jsonify(db_pool.stats())
+
+@main_bp.route('/metrics/cache', methods=['GET'])
+def cache_metrics():
+    # 本程序的預測快取（記憶體 LRU / 資料表 / 實際推論）與帳號統計快取的命中率
+    return jsonify({
+        "predictions": prediction_cache_stats(),
+        "user_stats": stats_cache.stats(),
+    })
 
 @main_bp.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        username = request.form.get('username')
+        username = _normalize_username(request.form.get('username'))
 
         if not username:
             return render_template('index.html', error="請輸入帳號")
 
-        conn = connect_to_db()
-        # 第一步：爬蟲爬資料進資料庫
-        scrape_profile(username)
+        if _model_failed():
+            return render_template('index.html', error="模型載入失敗，正在重新載入，請稍後再試"), 503
+
+        # 爬蟲與模型預測交給背景 worker，頁面輪詢工作狀態
+        job_id = enqueue_job(username)
+        return render_template('index.html', username=username, job_id=job_id)
 
-        # 第二步：執行模型預測
-        process_posts()
+    return render_template('index.html')
+
+@main_bp.route('/jobs', methods=['POST'])
+def create_job():
+    # JSON API：送出帳號分析，回傳 202 與查詢進度的網址；錯誤一律回傳 {"status": "error", "detail": ...}
+    data = request.get_json(silent=True) or {}
+    username = _normalize_username(data.get('username'))
+    if not username:
+        return jsonify({"status": "error", "detail": "請提供 username"}), 400
+
+    if _model_failed():
+        return jsonify({"status": "error", "detail": "模型尚未就緒"}), 503, {"Retry-After": "30"}
+
+    job = get_job(enqueue_job(username))
+    links = _job_links(job)
+    return jsonify({
+        "job_id": job['id'],
+        "username": job['username'],
+        "status": job['status'],
+        **links,
+    }), 202, {"Location": links['status_url']}
+
+@main_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "detail": "找不到此工作"}), 404
+
+    return jsonify({
+        "job_id": job['id'],
+        "username": job['username'],
+        "status": job['status'],
+        "progress": job['progress'],
+        "error": job['error'],
+        "result": job['result'],
+        **_job_links(job),
+    })
 
-        # 第三步：統計並取得厭女文內容（貼文 + 留言）
-        stats, misogynistic_texts = get_post_stats_and_misogynistic_texts(username)
+@main_bp.route('/users/<username>/flagged', methods=['GET'])
+def flagged_texts(username):
+    # 厭女貼文與回覆的分頁 API；以回傳的 next_url 取得下一頁
+    order = request.args.get('order', 'confidence')
+    if order not in FLAGGED_ORDERS:
+        return jsonify({"status": "error", "detail": f"order 只能是 {', '.join(FLAGGED_ORDERS)}"}), 400
+    limit = min(max(request.args.get('limit', FLAGGED_PAGE_SIZE, type=int), 1), FLAGGED_MAX_PAGE_SIZE)
 
-        return render_template(
-            'index.html',
-            username=username,
-            stats=stats,
-            posts=misogynistic_texts  # 每個 post 是 dict: {'text': ...}
+    try:
+        items, next_cursor = get_misogynistic_texts_page(
+            get_db(), username, order, request.args.get('cursor'), limit
         )
+    except ValueError as e:
+        return jsonify({"status": "error", "detail": str(e)}), 400
 
-    return render_template('index.html')
+    return jsonify({
+        "items": [
+            {
+                "text": item['text'],
+                "source": item['source'],
+                "confidence": item['confidence'],
+                "created_at": item['created_at'].isoformat() if item['created_at'] else None,
+            }
+            for item in items
+        ],
+        "next_cursor": next_cursor,
+        "next_url": url_for('main.flagged_texts', username=username, order=order, limit=limit, cursor=next_cursor)
+        if next_cursor else None,
+    })
+
+@main_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return redirect(url_for('main.index'))
+
+    if job['status'] != STATUS_DONE:
+        return render_template('index.html', username=job['username'], job_id=job_id, error=job['error'])
+
+    order = request.args.get('order', 'confidence')
+    if order not in FLAGGED_ORDERS:
+        order = 'confidence'
+
+    # 串流輸出：標題與統計先送出，厭女文列表在輸出到該處時才查詢（stream_template 內部以 stream_with_context
+    # 保留請求 context，查詢用的連線在串流結束後才歸還）；之後的頁面由前端呼叫 flagged_texts 取得
+    return Response(stream_template(
+        'index.html',
+        username=job['username'],
+        job_id=job_id,
+        order=order,
+        stats=job['result']['stats'],
+        posts=_FlaggedPage(job['username'], order)  # 每個 post 是 dict: {'text': ...}
+    ), mimetype='text/html')
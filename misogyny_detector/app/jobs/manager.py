@@ -0,0 +1,379 @@
+# app/jobs/manager.py
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.threads.browser import browser_pool
+from app.threads.crawler import crawl_profile
+from app.models.detector import (
+    process_posts, get_post_stats, invalidate_user_stats, start_model_loading, model_ready, model_status
+)
+
+# 工作佇列存放在本機 SQLite，讓同一台機器上的所有 gunicorn worker 共用
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'misogyny_jobs.sqlite3'))
+# 每個程序同時進行的分析數：爬蟲與資料庫 I/O 都在 asyncio 上執行，一個 worker 可以同時處理多筆
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', os.getenv('JOB_WORKERS', 8)))
+# 模型預測吃 CPU，同時預測的分析數另外限制
+SCORING_CONCURRENCY = int(os.getenv('SCORING_CONCURRENCY', 1))
+POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+# 完成的工作保留多久（秒）後清除
+JOB_TTL = int(os.getenv('JOB_TTL', 24 * 60 * 60))
+# 爬完資料後最多等模型載入多久（秒）才開始預測
+MODEL_WAIT_TIMEOUT = int(os.getenv('MODEL_WAIT_TIMEOUT', 600))
+MODEL_POLL_INTERVAL = 1.0
+# 執行中的工作定期更新 heartbeat_at；超過 JOB_LEASE_TIMEOUT（秒）沒有更新視為執行它的程序已經結束，
+# 重新排隊，重試 JOB_MAX_ATTEMPTS 次後標記為失敗
+JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+JOB_LEASE_TIMEOUT = int(os.getenv('JOB_LEASE_TIMEOUT', 300))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# 工作分派啟動失敗或意外結束後，重新啟動前的等待時間（秒），每次失敗加倍直到上限
+DISPATCHER_RETRY_MIN = float(os.getenv('DISPATCHER_RETRY_MIN', 5))
+DISPATCHER_RETRY_MAX = float(os.getenv('DISPATCHER_RETRY_MAX', 300))
+
+STATUS_QUEUED = 'queued'
+STATUS_CRAWLING = 'crawling'
+STATUS_SCORING = 'scoring'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_dispatcher_lock = threading.Lock()
+_dispatcher_started = False
+# 工作分派狀態，/readyz 回報用；state：stopped → starting → running / failed
+dispatcher_status = {'state': 'stopped', 'error': None, 'started_at': None, 'restarts': 0}
+# 取得工作的程序，寫入 jobs.owner
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _connect():
+    """
+    建立 SQLite 連線（autocommit，交易由呼叫端以 BEGIN 控制）
+    """
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_job_store():
+    """
+    建立 jobs 資料表
+    """
+    conn = _connect()
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        # 舊的工作資料庫沒有後來新增的欄位
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, definition in (
+            ('progress', 'TEXT'),
+            ('owner', 'TEXT'),
+            ('claimed_at', 'REAL'),
+            ('heartbeat_at', 'REAL'),
+            ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+        ):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+    finally:
+        conn.close()
+
+
+def enqueue_job(username):
+    """
+    新增一筆分析工作，回傳 job id
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, username, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, username, STATUS_QUEUED, now, now)
+        )
+    finally:
+        conn.close()
+    return job_id
+
+
+def get_job(job_id):
+    """
+    取得工作狀態與結果，找不到時回傳 None
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['progress'] = json.loads(job['progress']) if job['progress'] else None
+    return job
+
+
+def _set_status(job_id, status, result=None, error=None):
+    # 租約過期、工作已被其他程序重新取得時不覆寫
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND owner = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(),
+             job_id, _OWNER)
+        )
+    finally:
+        conn.close()
+
+
+def _heartbeat(job_id):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ?",
+            (time.time(), job_id, _OWNER)
+        )
+    finally:
+        conn.close()
+
+
+def _set_progress(job_id, progress):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ? AND owner = ?",
+            (json.dumps(progress, ensure_ascii=False), time.time(), job_id, _OWNER)
+        )
+    finally:
+        conn.close()
+
+
+def _release_expired_leases(conn, now):
+    """
+    heartbeat 逾時的執行中工作：已達重試上限的標記為失敗，其餘重新排隊
+    """
+    expired = "status IN (?, ?) AND COALESCE(heartbeat_at, updated_at) < ?"
+    params = (STATUS_CRAWLING, STATUS_SCORING, now - JOB_LEASE_TIMEOUT)
+    conn.execute(
+        f"UPDATE jobs SET status = ?, error = ?, owner = NULL, updated_at = ? WHERE {expired} AND attempts >= ?",
+        (STATUS_FAILED, f"執行工作的程序中斷（已嘗試 {JOB_MAX_ATTEMPTS} 次）", now, *params, JOB_MAX_ATTEMPTS)
+    )
+    conn.execute(
+        f"UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE {expired}",
+        (STATUS_QUEUED, now, *params)
+    )
+
+
+def _claim_next_job():
+    """
+    取出最舊的排隊工作並標記為執行中；BEGIN IMMEDIATE 確保多個 worker 不會搶到同一筆
+    取得前先回收租約過期的工作，程序中途結束時工作不會永遠停在執行中
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        _release_expired_leases(conn, now)
+        row = conn.execute(
+            "SELECT id, username FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+            (STATUS_QUEUED,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, claimed_at = ?, heartbeat_at = ?, updated_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (STATUS_CRAWLING, _OWNER, now, now, now, row['id'])
+            )
+        conn.execute("COMMIT")
+        return dict(row) if row is not None else None
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _purge_expired_jobs():
+    conn = _connect()
+    try:
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (STATUS_DONE, STATUS_FAILED, time.time() - JOB_TTL)
+        )
+    finally:
+        conn.close()
+
+
+async def _wait_for_model(timeout):
+    """
+    在 event loop 上等待模型載入完成（必要時先開始載入），不佔用執行緒；回傳模型是否可用
+    """
+    start_model_loading()
+    deadline = time.monotonic() + timeout
+    while model_status['state'] == 'loading' and time.monotonic() < deadline:
+        await asyncio.sleep(MODEL_POLL_INTERVAL)
+    return model_ready()
+
+
+async def run_analysis(job_id, username, scoring_slots):
+    """
+    執行一次完整分析：爬蟲 → 模型預測 → 統計
+    在 browser pool 的 event loop 上執行；會阻塞的資料庫與模型呼叫交給執行緒
+    """
+    # 第一步：爬蟲爬資料進資料庫
+    parsed = await crawl_profile(username)
+    inserted_ids = parsed["inserted_ids"]
+    progress = {
+        'threads': len(parsed["threads"]),
+        'new_posts': len(inserted_ids["posts"]),
+        'new_replies': len(inserted_ids["replies"]),
+        'crawl_skipped': bool(parsed.get("skipped")),
+    }
+    await asyncio.to_thread(_set_progress, job_id, progress)
+
+    # 第二步：對這次爬蟲新增的資料（可能包含其他帳號的回覆）執行模型預測，
+    # 再補上該帳號先前未預測完的資料（例如上次分析中途失敗），否則這些資料不會再被預測
+    # 模型仍在背景載入時先等待，爬蟲不受影響
+    await asyncio.to_thread(_set_status, job_id, STATUS_SCORING)
+    if not await _wait_for_model(MODEL_WAIT_TIMEOUT):
+        raise RuntimeError(f"模型尚未就緒（{model_status['state']}）：{model_status['error'] or '載入逾時'}")
+    async with scoring_slots:
+        scored = 0
+        if inserted_ids["posts"] or inserted_ids["replies"]:
+            # 新增的資料會改變總數，即使沒有任何一筆需要預測也要讓統計快取失效
+            invalidate_user_stats([username])
+            scored += await asyncio.to_thread(process_posts, ids=inserted_ids)
+        scored += await asyncio.to_thread(process_posts, username=username)
+    progress['scored'] = scored
+    await asyncio.to_thread(_set_progress, job_id, progress)
+
+    # 第三步：統計；厭女文內容（貼文 + 留言）在結果頁與 API 分頁讀取
+    return {'stats': await asyncio.to_thread(get_post_stats, username)}
+
+
+async def _keep_lease(job_id):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            await asyncio.to_thread(_heartbeat, job_id)
+        except sqlite3.Error as e:
+            print(f"更新工作 {job_id} heartbeat 錯誤: {e}")
+
+
+async def _run_job(job, scoring_slots):
+    print(f"🚀 開始分析工作 {job['id']}（{job['username']}）")
+    lease = asyncio.create_task(_keep_lease(job['id']))
+    try:
+        result = await run_analysis(job['id'], job['username'], scoring_slots)
+        await asyncio.to_thread(_set_status, job['id'], STATUS_DONE, result)
+        print(f"✅ 工作 {job['id']} 完成")
+    except Exception as e:
+        print(f"工作 {job['id']} 失敗: {e}")
+        await asyncio.to_thread(_set_status, job['id'], STATUS_FAILED, None, str(e))
+    finally:
+        lease.cancel()
+
+
+async def _dispatch(concurrency):
+    """
+    持續從佇列取出工作，同時最多執行 concurrency 筆
+    """
+    # 每筆執行中的工作都可能同時佔用一個執行緒（資料庫、模型預測），另外保留給取工作與 heartbeat；
+    # 預設 executor 只有 min(32, CPU + 4) 個執行緒，CPU 少的機器上會讓工作互相排隊
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=concurrency + 4, thread_name_prefix='job-io')
+    )
+    scoring_slots = asyncio.Semaphore(SCORING_CONCURRENCY)
+    running = set()
+    while True:
+        if len(running) >= concurrency:
+            # 完成的工作由 done callback 移出 running
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            continue
+
+        try:
+            job = await asyncio.to_thread(_claim_next_job)
+            if job is None:
+                await asyncio.to_thread(_purge_expired_jobs)
+        except sqlite3.Error as e:
+            print(f"讀取工作佇列錯誤: {e}")
+            job = None
+
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        task = asyncio.create_task(_run_job(job, scoring_slots))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+
+def _start_dispatcher(concurrency):
+    """
+    啟動工作分派並持續監看：Chromium 啟動失敗或分派意外結束時，等待一段時間（指數退避）後重新啟動，
+    否則這個程序之後再也不會取出排隊中的工作
+    """
+    delay = DISPATCHER_RETRY_MIN
+    while True:
+        dispatcher_status.update(state='starting')
+        started_at = time.time()
+        try:
+            # 第一次使用 browser pool 會啟動 Chromium，因此在背景執行緒進行
+            dispatcher = browser_pool.submit(_dispatch, concurrency)
+        except Exception as e:
+            print(f"分析工作分派啟動失敗: {e}")
+            dispatcher_status.update(state='failed', error=f"啟動失敗: {e}")
+        else:
+            print(f"✅ 已啟動分析工作分派（同時 {concurrency} 筆）")
+            dispatcher_status.update(state='running', error=None, started_at=started_at)
+            try:
+                dispatcher.result()
+                error = "分派結束"
+            except Exception as e:
+                error = str(e)
+            print(f"分析工作分派意外結束: {error}")
+            dispatcher_status.update(state='failed', error=error)
+            if time.time() - started_at > DISPATCHER_RETRY_MAX:
+                # 執行了一段時間才結束，不是連續失敗，從最短的等待時間重新開始
+                delay = DISPATCHER_RETRY_MIN
+
+        print(f"⏳ {delay:.0f} 秒後重新啟動分析工作分派")
+        time.sleep(delay)
+        delay = min(delay * 2, DISPATCHER_RETRY_MAX)
+        dispatcher_status['restarts'] += 1
+
+
+def dispatcher_ready():
+    return dispatcher_status['state'] == 'running'
+
+
+def start_workers(concurrency=JOB_CONCURRENCY):
+    """
+    在 browser pool 的 event loop 上啟動工作分派（重複呼叫不會重複啟動），不阻塞呼叫端；
+    失敗時由 _start_dispatcher 自行重試
+    """
+    global _dispatcher_started
+    with _dispatcher_lock:
+        if _dispatcher_started:
+            return
+        init_job_store()
+        threading.Thread(target=_start_dispatcher, args=(concurrency,), name="job-dispatcher", daemon=True).start()
+        _dispatcher_started = True
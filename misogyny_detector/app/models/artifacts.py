@@ -0,0 +1,259 @@
+# app/models/artifacts.py
+
+"""
+模型檔案管理：從 S3 下載模型到本機的版本化快取目錄
+
+- 以 manifest（{prefix}/manifest.json）列出每個檔案的大小與 sha256，下載後逐一驗證；
+  沒有 manifest 時改用 S3 物件清單的大小與 ETag（非 multipart 上傳的 ETag 即 MD5）
+- 大檔案以 multipart 分段平行下載，多個檔案也同時下載
+- 先下載到暫存目錄，驗證通過後才以 rename 原子地放進 {cache_dir}/{version}，
+  中斷或驗證失敗不會留下看起來完整的快取
+- 同一台機器上的多個 worker 以檔案鎖協調，只有一個會下載，其他的等待後直接使用
+- MODEL_PREFIX 也可以指向單一個壓縮檔（.tar.gz / .zip 等），下載驗證後解壓縮到版本目錄
+
+manifest.json 格式：
+    {"version": "0321latest", "files": [{"path": "config.json", "size": 123, "sha256": "..."}]}
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只能不加鎖
+    fcntl = None
+
+MODEL_BUCKET = os.getenv('MODEL_BUCKET', 'misogyny-models')
+MODEL_PREFIX = os.getenv('MODEL_PREFIX', 'Chinese_misogyny_detection_model_0321latest')
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'model_cache'))
+MANIFEST_NAME = 'manifest.json'
+# 同時下載的檔案數與每個檔案的分段並行數
+DOWNLOAD_CONCURRENCY = int(os.getenv('MODEL_DOWNLOAD_CONCURRENCY', 4))
+MULTIPART_CONCURRENCY = int(os.getenv('MODEL_MULTIPART_CONCURRENCY', 8))
+MULTIPART_CHUNK_SIZE = int(os.getenv('MODEL_MULTIPART_CHUNK_MB', 16)) * 1024 * 1024
+
+# 快取目錄內代表下載並驗證完成的標記檔
+_COMPLETE_MARKER = '.complete'
+
+
+class ArtifactError(Exception):
+    """模型檔案下載或驗證失敗"""
+
+
+def ensure_model(bucket=MODEL_BUCKET, prefix=MODEL_PREFIX, cache_dir=MODEL_CACHE_DIR, s3_client=None):
+    """
+    確保模型已下載並驗證到本機快取，回傳該版本的目錄路徑
+    """
+    s3_client = s3_client or boto3.client('s3')
+    prefix = prefix.rstrip('/')
+    try:
+        manifest = fetch_manifest(s3_client, bucket, prefix)
+    except (ArtifactError, BotoCoreError, ClientError) as e:
+        # 連不上 S3 時沿用本機最新的完整版本
+        cached = _latest_complete(cache_dir)
+        if cached is None:
+            raise
+        print(f"⚠ 無法取得模型 manifest（{e}），改用本機快取 {cached}")
+        return cached
+    target = os.path.join(cache_dir, _safe_name(manifest['version']))
+    if _is_complete(target):
+        return target
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with file_lock(f"{target}.lock"):
+        # 等鎖期間可能已有其他 worker 下載完成
+        if _is_complete(target):
+            return target
+
+        staging = tempfile.mkdtemp(prefix=f".{os.path.basename(target)}-", dir=cache_dir)
+        try:
+            _download_all(s3_client, bucket, prefix, manifest['files'], staging)
+            with open(os.path.join(staging, _COMPLETE_MARKER), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            if os.path.exists(target):
+                # 先前中斷留下的不完整目錄
+                shutil.rmtree(target)
+            os.rename(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    print(f"✅ 模型 {manifest['version']} 已下載並驗證：{target}")
+    return target
+
+
+def fetch_manifest(s3_client, bucket, prefix):
+    """
+    讀取 S3 上的 manifest.json；不存在時由物件清單產生（大小 + ETag）
+    """
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=f"{prefix}/{MANIFEST_NAME}")['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise ArtifactError(f"無法讀取 manifest: {e}") from e
+        return _manifest_from_listing(s3_client, bucket, prefix)
+
+    manifest = json.loads(body)
+    if not manifest.get('files'):
+        raise ArtifactError(f"manifest 沒有列出任何檔案：s3://{bucket}/{prefix}/{MANIFEST_NAME}")
+    manifest.setdefault('version', hashlib.sha256(body).hexdigest()[:12])
+    return manifest
+
+
+def _manifest_from_listing(s3_client, bucket, prefix):
+    files = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/"):
+        for obj in page.get('Contents', []):
+            path = obj['Key'][len(prefix) + 1:]
+            if not path or path.endswith('/'):
+                continue
+            files.append(_listing_entry(path, obj['Size'], obj['ETag']))
+    if not files:
+        # prefix 本身是單一個物件（壓縮檔）
+        files = [_archive_entry(s3_client, bucket, prefix)]
+
+    files.sort(key=lambda entry: entry['path'])
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:12]
+    return {'version': f"{os.path.basename(prefix)}-{digest}", 'files': files}
+
+
+def _listing_entry(path, size, etag):
+    entry = {'path': path, 'size': size}
+    etag = etag.strip('"')
+    if '-' not in etag:
+        entry['md5'] = etag
+    return entry
+
+
+def _archive_entry(s3_client, bucket, key):
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        raise ArtifactError(f"S3 上找不到模型檔案：s3://{bucket}/{key}") from e
+    entry = _listing_entry(os.path.basename(key), head['ContentLength'], head['ETag'])
+    entry.update(key=key, archive=True)
+    return entry
+
+
+def _download_all(s3_client, bucket, prefix, files, staging):
+    config = TransferConfig(
+        multipart_threshold=MULTIPART_CHUNK_SIZE,
+        multipart_chunksize=MULTIPART_CHUNK_SIZE,
+        max_concurrency=MULTIPART_CONCURRENCY,
+        use_threads=True,
+    )
+
+    def download(entry):
+        local_path = os.path.join(staging, _safe_path(entry['path']))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        key = entry.get('key', f"{prefix}/{entry['path']}")
+        s3_client.download_file(bucket, key, local_path, Config=config)
+        verify_file(local_path, entry)
+        if entry.get('archive'):
+            _extract_archive(local_path, staging)
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        # list() 讓任何一個檔案的例外都會拋出
+        list(executor.map(download, files))
+
+
+def verify_file(local_path, entry):
+    """
+    依 manifest 項目檢查檔案大小與 sha256 / md5
+    """
+    size = os.path.getsize(local_path)
+    if 'size' in entry and size != entry['size']:
+        raise ArtifactError(f"{entry['path']} 大小不符：預期 {entry['size']}，實際 {size}")
+
+    algorithm = 'sha256' if 'sha256' in entry else 'md5' if 'md5' in entry else None
+    if algorithm is None:
+        return
+    digest = hashlib.new(algorithm)
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    if digest.hexdigest() != entry[algorithm]:
+        raise ArtifactError(f"{entry['path']} {algorithm} 不符")
+
+
+def _extract_archive(archive_path, staging):
+    """
+    把壓縮檔解開到 staging 後刪除壓縮檔；壓縮檔內只有一個最上層目錄時攤平到 staging
+    """
+    extracted = tempfile.mkdtemp(prefix='.extract-', dir=staging)
+    if tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            for member in archive.getmembers():
+                _safe_path(member.name)
+                if not (member.isfile() or member.isdir()):
+                    raise ArtifactError(f"壓縮檔內含不支援的項目：{member.name}")
+            archive.extractall(extracted)
+    elif zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for name in archive.namelist():
+                _safe_path(name)
+            archive.extractall(extracted)
+    else:
+        raise ArtifactError(f"{os.path.basename(archive_path)} 不是 tar 或 zip 壓縮檔")
+    os.remove(archive_path)
+
+    root = extracted
+    entries = os.listdir(root)
+    if len(entries) == 1 and os.path.isdir(os.path.join(root, entries[0])):
+        root = os.path.join(root, entries[0])
+    for name in os.listdir(root):
+        os.rename(os.path.join(root, name), os.path.join(staging, name))
+    shutil.rmtree(extracted)
+
+
+def _is_complete(path):
+    return os.path.isfile(os.path.join(path, _COMPLETE_MARKER))
+
+
+def _latest_complete(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return None
+    candidates = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    candidates = [path for path in candidates if _is_complete(path)]
+    return max(candidates, key=os.path.getmtime, default=None)
+
+
+def _safe_name(name):
+    return "".join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+def _safe_path(path):
+    # manifest 中的路徑不能跳出快取目錄
+    normalized = os.path.normpath(path)
+    if os.path.isabs(normalized) or normalized.startswith('..'):
+        raise ArtifactError(f"不合法的檔案路徑：{path}")
+    return normalized
+
+
+@contextmanager
+def file_lock(path):
+    """
+    以 fcntl.flock 取得的排他檔案鎖，讓同一台機器上的 worker 不會同時下載模型或匯出 ONNX
+    """
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
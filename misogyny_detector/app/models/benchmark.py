@@ -0,0 +1,89 @@
+# app/models/benchmark.py
+
+"""
+比較各推論後端的準確度與速度，並檢查與 fp32 模型的一致性
+
+用法：
+    python -m app.models.benchmark labeled.jsonl [--backends torch,int8,onnx] [--batch-size 32]
+
+labeled.jsonl 每行一筆 {"text": ..., "label": 0 或 1}；也接受含 text,label 欄位的 CSV。
+任何後端與 fp32 的預測一致率低於 --min-agreement 時以非零狀態碼結束。
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+
+from app.models import detector
+
+
+def load_samples(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [detector.normalize_text(row["text"]) for row in rows], [int(row["label"]) for row in rows]
+
+
+def run_backend(backend, texts, batch_size):
+    # 先跑一批暖機，避免第一批的初始化成本算進延遲
+    detector._infer(texts[:batch_size], batch_size, backend)
+
+    latencies = []
+    predictions = []
+    for start in range(0, len(texts), batch_size):
+        chunk = texts[start:start + batch_size]
+        start_time = time.perf_counter()
+        predictions.extend(detector._infer(chunk, batch_size, backend))
+        latencies.append(time.perf_counter() - start_time)
+    return predictions, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="inference backend parity and latency check")
+    parser.add_argument("samples", help="labeled sample (JSONL or CSV with text,label)")
+    parser.add_argument("--backends", default="torch,int8,onnx")
+    parser.add_argument("--batch-size", type=int, default=detector.BATCH_SIZE)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+
+    texts, labels = load_samples(args.samples)
+    # 各後端在下面自行建立；model_version 在 LONG_TEXT_MODE 為 max / mean 時還帶有模式後綴，不能拿來拆出模型版本
+    detector.load_model(init_inference_backend=False)
+    base_version = detector.base_model_version
+
+    reference = None
+    failed = False
+    print(f"{'backend':<8} {'accuracy':>9} {'agree':>7} {'max Δconf':>10} {'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9}")
+    for name in ["torch"] + [name for name in args.backends.split(",") if name != "torch"]:
+        try:
+            backend = detector.create_backend(name, detector.model, base_version)
+        except (RuntimeError, ValueError) as e:
+            print(f"{name:<8} 略過：{e}")
+            continue
+
+        predictions, latencies = run_backend(backend, texts, args.batch_size)
+        if reference is None:
+            reference = predictions
+
+        accuracy = sum(label == expected for (label, _), expected in zip(predictions, labels)) / len(labels)
+        agreement = sum(a[0] == b[0] for a, b in zip(predictions, reference)) / len(reference)
+        max_delta = max(abs(a[1] - b[1]) for a, b in zip(predictions, reference))
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        throughput = len(texts) / sum(latencies)
+        print(f"{name:<8} {accuracy:>9.4f} {agreement:>7.2%} {max_delta:>10.4f} {p50:>8.1f} {p95:>8.1f} {throughput:>9.1f}")
+
+        if agreement < args.min_agreement:
+            failed = True
+            print(f"⚠ {name} 與 fp32 的一致率 {agreement:.2%} 低於 {args.min_agreement:.2%}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
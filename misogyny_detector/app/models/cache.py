@@ -0,0 +1,143 @@
+# app/models/cache.py
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # 沒有安裝 redis 時只使用 in-process 快取
+    redis = None
+
+# 設定 CACHE_REDIS_URL（例如 redis://localhost:6379/0）時改用 Redis 相容的共用快取
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+
+
+class LRUCache:
+    """
+    執行緒安全、帶 TTL 的 in-process LRU 快取
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class RedisCache:
+    """
+    以 Redis 相容服務儲存 JSON 值的快取，讓多個 gunicorn worker 共用並一起失效
+    連線失敗時視為未命中，不影響正常查詢
+    """
+
+    def __init__(self, url, prefix, ttl=300):
+        self.prefix = prefix
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def get(self, key):
+        try:
+            raw = self._client.get(self._key(key))
+        except redis.RedisError as e:
+            print(f"快取讀取錯誤: {e}")
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self._client.set(self._key(key), json.dumps(value, ensure_ascii=False), ex=ttl or None)
+        except redis.RedisError as e:
+            print(f"快取寫入錯誤: {e}")
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            self._client.delete(*[self._key(key) for key in keys])
+        except redis.RedisError as e:
+            print(f"快取刪除錯誤: {e}")
+
+    def clear(self):
+        try:
+            for key in self._client.scan_iter(match=f"{self.prefix}*"):
+                self._client.delete(key)
+        except redis.RedisError as e:
+            print(f"快取清除錯誤: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_cache(name, max_size=1024, ttl=300):
+    """
+    依設定建立快取：有 CACHE_REDIS_URL 且已安裝 redis 時使用 Redis，否則使用 in-process LRU
+    存入 Redis 的值必須可以轉成 JSON
+    """
+    if CACHE_REDIS_URL:
+        if redis is not None:
+            return RedisCache(CACHE_REDIS_URL, prefix=f"{name}:", ttl=ttl)
+        print("⚠ 已設定 CACHE_REDIS_URL 但未安裝 redis 套件，改用 in-process 快取。")
+    return LRUCache(max_size=max_size, ttl=ttl)
@@ -0,0 +1,241 @@
+# app/models/db.py
+
+"""
+共用的 MySQL 連線池：detector、爬蟲與 Flask 請求都從這裡取得連線
+
+- 連線用完放回池中重複使用，最多同時開 DB_POOL_MAX_SIZE 條；閒置超過 DB_POOL_IDLE_TIMEOUT 的連線
+  會關閉，但至少保留 DB_POOL_MIN_SIZE 條
+- 取出時先 ping（pre-ping），斷線的連線直接換一條新的，不必每次連線都跑 SELECT 1
+- 放回時 rollback 未提交的交易，下一個使用者拿到的連線不會帶著舊的交易或快照
+- Flask 請求內以 get_db() 取得連線，請求結束時自動歸還
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pymysql
+from dotenv import load_dotenv
+from flask import g
+
+load_dotenv()
+
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+# 池滿時最多等待多久（秒）取得連線
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_IDLE_TIMEOUT = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+
+
+class PoolTimeout(pymysql.MySQLError):
+    """等待連線逾時"""
+
+
+class ConnectionPool:
+    """
+    執行緒安全的 pymysql 連線池；連線預設使用 DictCursor
+    """
+
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()  # (conn, 放回的時間)
+        self._size = 0  # 已開啟的連線數（閒置 + 借出）
+        self._cond = threading.Condition()
+        self._metrics = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'ping_failures': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'checkout_seconds_total': 0.0,
+            'checkout_seconds_max': 0.0,
+        }
+
+    def _connect(self):
+        conn = pymysql.connect(
+            host=os.getenv('DB_HOST'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            database=os.getenv('DB_NAME'),
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            **self.connect_kwargs
+        )
+        with self._cond:
+            self._metrics['connections_created'] += 1
+        return conn
+
+    def warm(self):
+        """
+        預先開好 min_size 條連線
+        """
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._discard()
+                raise
+            self.release(conn)
+
+    def acquire(self, timeout=None):
+        """
+        取得一條可用的連線；池滿時等待，逾時拋出 PoolTimeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start_time = time.perf_counter()
+        deadline = start_time + timeout
+        while True:
+            conn = None
+            with self._cond:
+                self._close_stale_idle()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(f"等待資料庫連線逾時（{timeout:.0f}s，上限 {self.max_size} 條）")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._discard()
+                    raise
+            elif not self._ping(conn):
+                # 斷線的連線丟掉，重新取一條
+                self._discard(conn)
+                continue
+
+            waited = time.perf_counter() - start_time
+            with self._cond:
+                self._metrics['checkouts'] += 1
+                self._metrics['wait_seconds_total'] += waited
+                self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+            conn._pool_checked_out_at = time.perf_counter()
+            return conn
+
+    def release(self, conn):
+        """
+        歸還連線；未提交的交易一律 rollback
+        """
+        held = time.perf_counter() - getattr(conn, '_pool_checked_out_at', time.perf_counter())
+        try:
+            if conn.open:
+                conn.rollback()
+        except pymysql.MySQLError:
+            pass
+        if not conn.open:
+            self._discard()
+            return
+        with self._cond:
+            self._metrics['checkout_seconds_total'] += held
+            self._metrics['checkout_seconds_max'] = max(self._metrics['checkout_seconds_max'], held)
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _ping(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except pymysql.MySQLError:
+            with self._cond:
+                self._metrics['ping_failures'] += 1
+            return False
+
+    def _discard(self, conn=None):
+        if conn is not None:
+            try:
+                conn.close()
+            except pymysql.MySQLError:
+                pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _close_stale_idle(self):
+        # 呼叫端需持有 self._cond；最舊的閒置連線在左邊
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            try:
+                conn.close()
+            except pymysql.MySQLError:
+                pass
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                try:
+                    conn.close()
+                except pymysql.MySQLError:
+                    pass
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update(size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle),
+                         min_size=self.min_size, max_size=self.max_size)
+        checkouts = stats['checkouts']
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / checkouts if checkouts else 0.0
+        stats['checkout_seconds_avg'] = stats['checkout_seconds_total'] / checkouts if checkouts else 0.0
+        return stats
+
+
+db_pool = ConnectionPool()
+
+
+def get_db():
+    """
+    取得目前 Flask 請求專用的連線（同一個請求內共用），請求結束時由 teardown 歸還
+    """
+    if 'db_conn' not in g:
+        g.db_conn = db_pool.acquire()
+    return g.db_conn
+
+
+def _release_request_connection(exc=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+
+def init_app(app):
+    """
+    註冊請求結束時歸還連線，預先開好最少的連線數，並套用尚未執行的 schema migration
+    """
+    from app.models.schema import SCHEMA_AUTO_MIGRATE, migrate
+
+    app.teardown_appcontext(_release_request_connection)
+    try:
+        db_pool.warm()
+        if SCHEMA_AUTO_MIGRATE:
+            migrate()
+    except (pymysql.MySQLError, RuntimeError) as e:
+        print(f"資料庫初始化錯誤: {e}")
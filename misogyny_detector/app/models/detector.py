@@ -1,71 +1,177 @@
 # app/models/detector.py
 
-import pymysql
 import torch
 from transformers import BertTokenizer, BertForSequenceClassification
+import base64
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
+from datetime import datetime
+from itertools import islice
 from dotenv import load_dotenv
-import boto3
+from app.models.artifacts import ensure_model, file_lock
+from app.models.cache import LRUCache, create_cache
+from app.models.db import db_pool
+from app.models.user_stats import get_user_stats, record_label_changes
+from app.models import ipc
+
+try:
+    import onnxruntime
+except ImportError:  # 只有 INFERENCE_BACKEND=onnx 時需要
+    onnxruntime = None
 
 # 載入 .env
 load_dotenv()
 
-def download_model_from_s3(bucket_name, model_key, local_file_path):
-    # 初始化 S3 客戶端
-    s3_client = boto3.client('s3')
-    try:
-        # 下載模型檔案
-        s3_client.download_file(bucket_name, model_key, local_file_path)
-        print(f"Model downloaded successfully: {local_file_path}")
-    except Exception as e:
-        print(f"Error downloading model from S3: {e}")
-
 # 初始化模型與 tokenizer（只載入一次）
 model = None
 tokenizer = None
+# 模型版本：預測快取的 key 包含此值，換模型或推論後端後舊的快取自動失效
+model_version = None
+# 模型檔案本身的版本（不含推論後端與長文模式）
+base_model_version = None
+# 實際執行推論的後端（見 create_backend、init_backend）
+inference_backend = None
+
+# 推論後端：torch（fp32）、int8（動態量化）、onnx（ONNX Runtime）
+INFERENCE_BACKENDS = ('torch', 'int8', 'onnx')
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+ONNX_DIR = os.getenv('ONNX_DIR', os.path.join(os.path.dirname(__file__), 'onnx'))
+
+# 設定 INFERENCE_SERVER_SOCKET 時，推論交給 app.models.inference_server 執行，
+# 各 web worker 不再各自載入一份模型權重
+INFERENCE_SERVER_SOCKET = os.getenv('INFERENCE_SERVER_SOCKET')
+INFERENCE_SERVER_TIMEOUT = int(os.getenv('INFERENCE_SERVER_TIMEOUT', 300))
+
+# 模型輸入的最大 token 數與每批推論的筆數
+MAX_LENGTH = 128
+BATCH_SIZE = int(os.getenv('PREDICT_BATCH_SIZE', 32))
+
+# 依 token 長度排序後再分批，減少 padding；score_rows 每次取 BATCH_SIZE * SORT_WINDOW_BATCHES 筆一起排程
+SORT_BY_LENGTH = os.getenv('PREDICT_SORT_BY_LENGTH', '1') != '0'
+SORT_WINDOW_BATCHES = int(os.getenv('PREDICT_SORT_WINDOW_BATCHES', 8))
+padding_counters = {'real_tokens': 0, 'padded_tokens': 0}
+
+# 長文處理：truncate 只看前 MAX_LENGTH 個 token；max / mean 則把長文切成重疊的視窗一起推論，
+# 再以「厭女機率最高的視窗」或「各視窗平均」決定結果
+LONG_TEXT_MODE = os.getenv('PREDICT_LONG_TEXT_MODE', 'truncate')
+WINDOW_OVERLAP = int(os.getenv('PREDICT_WINDOW_OVERLAP', 32))
+POSITIVE_LABEL = 1
+
+# 寫回預測結果時，每累積多少筆 commit 一次
+COMMIT_INTERVAL = int(os.getenv('PREDICT_COMMIT_INTERVAL', 500))
 
-def load_model():
+# 串流讀取待預測資料：每頁筆數與最多預先讀取的頁數
+PAGE_SIZE = int(os.getenv('PREDICT_PAGE_SIZE', 1000))
+PREFETCH_PAGES = int(os.getenv('PREDICT_PREFETCH_PAGES', 2))
+
+# 需要預測的資料表與其文字欄位
+SCORED_TABLES = [('posts', 'post_text'), ('replies', 'reply_text')]
+
+# 每個帳號的統計快取；寫入新的預測結果時失效
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', 300))
+STATS_CACHE_SIZE = int(os.getenv('STATS_CACHE_SIZE', 1024))
+stats_cache = create_cache('user_stats', max_size=STATS_CACHE_SIZE, ttl=STATS_CACHE_TTL)
+
+# 厭女文列表分頁：每頁筆數上限，以及可用的排序（信心度或爬取時間，皆由高到低）
+FLAGGED_PAGE_SIZE = int(os.getenv('FLAGGED_PAGE_SIZE', 50))
+FLAGGED_MAX_PAGE_SIZE = 200
+FLAGGED_ORDERS = {'confidence': 'confidence', 'recent': 'created_at'}
+
+# 以正規化文字的 hash 快取預測結果，重複的文字（複製貼上、垃圾訊息、純表情）不再重跑模型
+# PREDICTION_CACHE_TABLE=1 時另外存進資料庫的 prediction_cache 資料表（見 app.models.schema），跨程序與重啟共用
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', 100000))
+PREDICTION_CACHE_TABLE = os.getenv('PREDICTION_CACHE_TABLE', '0') == '1'
+prediction_cache = LRUCache(max_size=PREDICTION_CACHE_SIZE, ttl=0)
+prediction_cache_counters = {'table_hits': 0, 'inferences': 0}
+
+# 模型在背景執行緒載入（見 start_model_loading），載入期間 web 照常服務
+# state：idle → loading → ready / failed
+model_status = {'state': 'idle', 'error': None, 'started_at': None, 'loaded_at': None}
+_model_lock = threading.Lock()
+
+def load_model(init_inference_backend=True):
     """
     載入 BERT 模型與 tokenizer
+    init_inference_backend=False 時只載入權重，推論後端之後再以 init_backend 建立
+    （推論伺服器在 fork 前載入權重，各 worker fork 後才建立自己的 ONNX Runtime session / 量化模型）
     """
-    global model, tokenizer
+    global model, tokenizer, model_version, base_model_version, inference_backend
+
+    if INFERENCE_SERVER_SOCKET:
+        # 只向推論伺服器取得模型版本，快取 key 與伺服器上的模型一致
+        model_version = ipc.request(INFERENCE_SERVER_SOCKET, {'op': 'version'}, INFERENCE_SERVER_TIMEOUT)['version']
+        prediction_cache.clear()
+        print(f"✅ 使用推論伺服器 {INFERENCE_SERVER_SOCKET}（版本 {model_version}）")
+        return
 
+    # 本機有 ./Model 時直接使用（開發用）；否則從 S3 下載並驗證到版本化的快取目錄
     model_path = os.path.join(os.path.dirname(__file__), './Model')
     if not os.path.exists(model_path):
-        # 假設你的 S3 桶名稱是 'misogyny-models'，模型檔案的 key 是 'Chinese_misogyny_detection_model_best'
-        download_model_from_s3('misogyny-models', 'Chinese_misogyny_detection_model_0321latest', model_path)
+        model_path = ensure_model()
     model = BertForSequenceClassification.from_pretrained(model_path)
+    model.eval()
     tokenizer = BertTokenizer.from_pretrained(model_path)
-    print("✅ BERT 模型載入完成！")
+    if INFERENCE_BACKEND not in INFERENCE_BACKENDS:
+        raise ValueError(f"未知的推論後端: {INFERENCE_BACKEND}")
+    base_model_version = os.getenv('MODEL_VERSION') or _model_fingerprint(model_path)
+    inference_backend = None
+    if init_inference_backend:
+        init_backend()
+    model_version = f"{base_model_version}-{INFERENCE_BACKEND}"
+    if LONG_TEXT_MODE != 'truncate':
+        model_version += f"-{LONG_TEXT_MODE}"
+    prediction_cache.clear()
+    print(f"✅ BERT 模型載入完成！（版本 {model_version}）")
+
 
+def init_backend():
+    """
+    以已載入的權重建立 INFERENCE_BACKEND 指定的推論後端
+    """
+    global inference_backend
+    inference_backend = create_backend(INFERENCE_BACKEND, model, base_model_version)
 
 
-def connect_to_db():
+def start_model_loading():
     """
-    建立資料庫連線
+    在背景執行緒載入模型並立即返回；已在載入或已就緒時不做事，上次失敗則重新載入
     """
+    with _model_lock:
+        if model_status['state'] in ('loading', 'ready'):
+            return
+        model_status.update(state='loading', error=None, started_at=time.time())
+    threading.Thread(target=_load_model_in_background, name='model-loader', daemon=True).start()
+
+
+def _load_model_in_background():
     try:
-        conn = pymysql.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        print("✅ 資料庫連接成功！")
-        return conn
-    except pymysql.MySQLError as e:
-        print(f"資料庫連接錯誤: {e}")
-        return None
+        load_model()
+    except Exception as e:
+        print(f"❌ 模型載入失敗: {e}")
+        model_status.update(state='failed', error=str(e))
+    else:
+        model_status.update(state='ready', loaded_at=time.time())
+
+
+def model_ready():
+    return model_status['state'] == 'ready'
 
-def close_db_connection(conn):
+
+def _model_fingerprint(model_path):
     """
-    關閉資料庫連線
+    以模型目錄內檔案的名稱、大小與修改時間產生版本字串
     """
-    if conn and conn.open:
-        conn.close()
-        print("🔌 資料庫連接已關閉。")
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(model_path)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f"{os.path.relpath(os.path.join(root, name), model_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
 
 def predict_label(text):
     """
@@ -74,16 +180,280 @@ def predict_label(text):
     if text is None:
         return None, None
 
-    cleaned_text = text.lower().strip()
-    inputs = tokenizer(cleaned_text, return_tensors="pt", padding=True, truncation=True, max_length=128)
+    return predict_labels([text])[0]
+
+def normalize_text(text):
+    return text.lower().strip()
+
+def prediction_cache_key(normalized_text):
+    """
+    預測快取的 key：正規化文字加上模型版本的 sha256
+    """
+    return hashlib.sha256(f"{model_version}\0{normalized_text}".encode('utf-8')).hexdigest()
+
+def predict_labels(texts, batch_size=BATCH_SIZE, conn=None):
+    """
+    批次預測多筆文本，回傳與輸入順序相同的 [(label, confidence), ...]
+    先查預測快取（conn 不為 None 且開啟 PREDICTION_CACHE_TABLE 時也查資料庫），
+    同一批內重複的文字只推論一次
+    """
+    results = [(None, None)] * len(texts)
+    positions = {}  # key -> 在 texts 中的位置
+    normalized = {}
+    for i, text in enumerate(texts):
+        if text is None:
+            continue
+        cleaned_text = normalize_text(text)
+        key = prediction_cache_key(cleaned_text)
+        positions.setdefault(key, []).append(i)
+        normalized[key] = cleaned_text
+
+    found = {}
+    for key in positions:
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            found[key] = cached
+
+    use_table = conn is not None and PREDICTION_CACHE_TABLE
+    missing = [key for key in positions if key not in found]
+    if use_table and missing:
+        from_table = _load_cached_predictions(conn, missing)
+        prediction_cache_counters['table_hits'] += len(from_table)
+        for key, prediction in from_table.items():
+            prediction_cache.set(key, prediction)
+        found.update(from_table)
+        missing = [key for key in missing if key not in found]
+
+    if missing:
+        inferred = dict(zip(missing, _infer([normalized[key] for key in missing], batch_size)))
+        prediction_cache_counters['inferences'] += len(inferred)
+        for key, prediction in inferred.items():
+            prediction_cache.set(key, prediction)
+        if use_table:
+            _store_cached_predictions(conn, inferred)
+        found.update(inferred)
+
+    for key, indexes in positions.items():
+        for i in indexes:
+            results[i] = found[key]
+    return results
+
+class TorchBackend:
+    """
+    以 PyTorch eager 模式推論（fp32 或動態量化後的模型）
+    """
+
+    def __init__(self, name, torch_model):
+        self.name = name
+        self.model = torch_model
+
+    def __call__(self, inputs):
+        with torch.no_grad():
+            return self.model(**inputs).logits
+
+
+class OnnxBackend:
+    """
+    以 ONNX Runtime 推論匯出的模型
+    """
+
+    name = 'onnx'
+
+    def __init__(self, onnx_path):
+        if onnxruntime is None:
+            raise RuntimeError("INFERENCE_BACKEND=onnx 需要安裝 onnxruntime")
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def __call__(self, inputs):
+        feeds = {name: tensor.numpy() for name, tensor in inputs.items() if name in self.input_names}
+        logits = self.session.run(['logits'], feeds)[0]
+        return torch.from_numpy(logits)
+
+
+def export_onnx(fp32_model, version):
+    """
+    將 fp32 模型匯出成 ONNX（每個模型版本只匯出一次），回傳檔案路徑
+    """
+    onnx_path = os.path.join(ONNX_DIR, f"{version}.onnx")
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    # 多個 worker 同時啟動時只讓一個匯出，其他的等待後直接使用
+    with file_lock(f"{onnx_path}.lock"):
+        if os.path.exists(onnx_path):
+            return onnx_path
+
+        dummy = tokenizer(["匯出用的範例文字"], return_tensors="pt")
+        input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['logits'] = {0: 'batch'}
+
+        # 先寫到暫存檔再改名，避免其他 worker 讀到寫到一半的檔案
+        tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+        torch.onnx.export(
+            fp32_model,
+            tuple(dummy[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=['logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+        os.replace(tmp_path, onnx_path)
+    print(f"✅ 已匯出 ONNX 模型：{onnx_path}")
+    return onnx_path
+
+
+def create_backend(name, fp32_model, version):
+    """
+    依名稱建立推論後端：torch、int8 或 onnx
+    """
+    if name == 'torch':
+        return TorchBackend('torch', fp32_model)
+    if name == 'int8':
+        quantized = torch.quantization.quantize_dynamic(fp32_model, {torch.nn.Linear}, dtype=torch.qint8)
+        return TorchBackend('int8', quantized)
+    if name == 'onnx':
+        return OnnxBackend(export_onnx(fp32_model, version))
+    raise ValueError(f"未知的推論後端: {name}（可用：{', '.join(INFERENCE_BACKENDS)}）")
+
+
+def _encode(texts, long_text_mode=LONG_TEXT_MODE):
+    """
+    將文本編碼成模型輸入（尚未 padding），回傳 (features, owners)
+    owners[j] 為第 j 個輸入所屬文本的位置；長文在視窗模式下會對應到多個輸入
+    """
+    if long_text_mode == 'truncate':
+        encodings = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+        features = [{key: encodings[key][i] for key in encodings.keys()} for i in range(len(texts))]
+        return features, list(range(len(texts)))
+
+    window = MAX_LENGTH - tokenizer.num_special_tokens_to_add()
+    step = max(window - WINDOW_OVERLAP, 1)
+    features = []
+    owners = []
+    for i, token_ids in enumerate(tokenizer(texts, add_special_tokens=False)['input_ids']):
+        # 短文只有一個視窗；長文每個視窗與前一個重疊 WINDOW_OVERLAP 個 token
+        for start in range(0, max(len(token_ids) - WINDOW_OVERLAP, 1), step):
+            input_ids = tokenizer.build_inputs_with_special_tokens(token_ids[start:start + window])
+            features.append({
+                'input_ids': input_ids,
+                'token_type_ids': [0] * len(input_ids),
+                'attention_mask': [1] * len(input_ids),
+            })
+            owners.append(i)
+    return features, owners
+
+def _aggregate(window_probs, long_text_mode=LONG_TEXT_MODE):
+    """
+    合併同一篇文本各視窗的機率：max 取厭女機率最高的視窗，mean 取平均
+    """
+    if len(window_probs) == 1:
+        return window_probs[0]
+    if long_text_mode == 'mean':
+        return [sum(column) / len(window_probs) for column in zip(*window_probs)]
+    return max(window_probs, key=lambda probs: probs[POSITIVE_LABEL])
+
+def _infer(texts, batch_size=BATCH_SIZE, backend=None, sort_by_length=SORT_BY_LENGTH, long_text_mode=LONG_TEXT_MODE):
+    """
+    以推論後端推論已正規化的文本，回傳與輸入順序相同的結果
+    先依 token 長度排序再分批，每批只 padding 到該批最長的輸入，推論完再還原順序
+    長文的各個視窗與其他文本一起排程分批
+    """
+    if not texts:
+        return []
+    if backend is None and INFERENCE_SERVER_SOCKET:
+        return _remote_infer(texts, batch_size)
+    backend = backend or inference_backend
+
+    features, owners = _encode(texts, long_text_mode)
+    lengths = [len(feature['input_ids']) for feature in features]
+    order = sorted(range(len(features)), key=lambda j: lengths[j]) if sort_by_length else list(range(len(features)))
 
-    with torch.no_grad():
-        outputs = model(**inputs)
-        probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        label = torch.argmax(probs, dim=1).item()
-        confidence = probs[0][label].item()
+    feature_probs = [None] * len(features)
+    for start in range(0, len(order), batch_size):
+        indexes = order[start:start + batch_size]
+        inputs = tokenizer.pad([features[j] for j in indexes], return_tensors="pt")
+        padding_counters['real_tokens'] += sum(lengths[j] for j in indexes)
+        padding_counters['padded_tokens'] += inputs['input_ids'].numel()
 
-    return label, confidence
+        probs = torch.nn.functional.softmax(backend(inputs), dim=-1)
+        for j, row in zip(indexes, probs.tolist()):
+            feature_probs[j] = row
+
+    grouped = [[] for _ in texts]
+    for j, i in enumerate(owners):
+        grouped[i].append(feature_probs[j])
+
+    results = []
+    for window_probs in grouped:
+        probs = _aggregate(window_probs, long_text_mode)
+        label = max(range(len(probs)), key=lambda k: probs[k])
+        results.append((label, probs[label]))
+    return results
+
+def _remote_infer(texts, batch_size=BATCH_SIZE):
+    """
+    把整批文本送到推論伺服器，由伺服器上的 worker 排序、分批與推論
+    """
+    response = ipc.request(
+        INFERENCE_SERVER_SOCKET,
+        {'op': 'infer', 'texts': texts, 'batch_size': batch_size},
+        INFERENCE_SERVER_TIMEOUT,
+    )
+    return [tuple(prediction) for prediction in response['predictions']]
+
+def padding_efficiency():
+    """
+    實際 token 佔送進模型 token 的比例（1.0 表示沒有 padding 浪費）
+    """
+    padded = padding_counters['padded_tokens']
+    return padding_counters['real_tokens'] / padded if padded else 1.0
+
+def _load_cached_predictions(conn, keys):
+    with conn.cursor() as cursor:
+        placeholders = ", ".join(["%s"] * len(keys))
+        cursor.execute(
+            f"SELECT text_hash, label, confidence FROM prediction_cache WHERE text_hash IN ({placeholders})",
+            keys
+        )
+        return {row['text_hash']: (row['label'], row['confidence']) for row in cursor.fetchall()}
+
+def _store_cached_predictions(conn, predictions):
+    # 跟著呼叫端的 commit 一起提交
+    with conn.cursor() as cursor:
+        cursor.executemany("""
+            INSERT INTO prediction_cache (text_hash, model_version, label, confidence)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE text_hash = text_hash
+        """, [(key, model_version, label, confidence) for key, (label, confidence) in predictions.items()])
+
+def prediction_cache_stats():
+    """
+    預測快取命中率：記憶體 LRU、資料庫資料表與實際推論的筆數
+    """
+    memory = prediction_cache.stats()
+    lookups = memory['hits'] + memory['misses']
+    table_hits = prediction_cache_counters['table_hits']
+    return {
+        'model_version': model_version,
+        'size': memory['size'],
+        'max_size': memory['max_size'],
+        'memory_hits': memory['hits'],
+        'table_hits': table_hits,
+        'inferences': prediction_cache_counters['inferences'],
+        'hit_rate': (memory['hits'] + table_hits) / lookups if lookups else 0.0,
+    }
+
+def update_prediction(post_id, table_name, label, confidence):
+    """
+    將單筆預測結果寫回資料庫
+    """
+    with db_pool.connection() as conn:
+        write_predictions(conn, table_name, [(post_id, label, confidence)])
+        conn.commit()
 
 def predict_and_update(text, post_id, table_name):
     """
@@ -98,91 +468,282 @@ def predict_and_update(text, post_id, table_name):
     print(f"文字: {text}")
     print(f"預測結果: {'厭女（1）' if label == 1 else '非厭女（0）'}，置信度: {confidence:.4f}")
 
-    conn = connect_to_db()
-    if conn:
-        try:
+    update_prediction(post_id, table_name, label, confidence)
+
+def write_predictions(conn, table_name, predictions):
+    """
+    以單一 multi-row UPDATE 將多筆預測結果寫回同一個資料表（不 commit）
+    predictions 為 [(id, label, confidence), ...]；同一個交易內一併更新 user_stats 的厭女數
+    """
+    if not predictions:
+        return 0
+
+    record_label_changes(conn, table_name, predictions)
+
+    ids = [row_id for row_id, _, _ in predictions]
+    label_cases = " ".join(["WHEN %s THEN %s"] * len(predictions))
+    confidence_cases = " ".join(["WHEN %s THEN %s"] * len(predictions))
+    placeholders = ", ".join(["%s"] * len(predictions))
+
+    params = []
+    for row_id, label, _ in predictions:
+        params.extend((row_id, label))
+    for row_id, _, confidence in predictions:
+        params.extend((row_id, confidence))
+    params.extend(ids)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {table_name}
+            SET is_misogyny = CASE id {label_cases} END,
+                confidence = CASE id {confidence_cases} END
+            WHERE id IN ({placeholders})
+        """, params)
+    return len(predictions)
+
+def iter_unlabeled_pages(conn, table_name, text_column, page_size=PAGE_SIZE, username=None, ids=None):
+    """
+    逐頁讀取尚未預測的資料
+    ids 不為 None 時只讀取這些資料列；否則以 id 做 keyset pagination，可用 username 限定帳號
+    """
+    if ids is not None:
+        ids = sorted(ids)
+        for start in range(0, len(ids), page_size):
+            chunk = ids[start:start + page_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
             with conn.cursor() as cursor:
                 cursor.execute(f"""
-                    UPDATE {table_name}
-                    SET is_misogyny = %s, confidence = %s
-                    WHERE id = %s
-                """, (label, confidence, post_id))
-                conn.commit()
-        finally:
-            close_db_connection(conn)
+                    SELECT id, username, {text_column} FROM {table_name}
+                    WHERE is_misogyny IS NULL AND id IN ({placeholders})
+                    ORDER BY id
+                """, chunk)
+                rows = cursor.fetchall()
+            if rows:
+                yield rows
+        return
 
+    user_filter = "AND username = %s" if username else ""
+    last_id = 0
+    while True:
+        params = [last_id, username, page_size] if username else [last_id, page_size]
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT id, username, {text_column} FROM {table_name}
+                WHERE is_misogyny IS NULL AND id > %s {user_filter}
+                ORDER BY id
+                LIMIT %s
+            """, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]['id']
 
-# 執行全部的 function
-def process_posts():
+def stream_unlabeled(table_name, text_column, page_size=PAGE_SIZE, prefetch_pages=PREFETCH_PAGES, username=None, ids=None):
     """
-    自動處理資料庫中尚未預測的 posts 和 replies
+    由背景執行緒以獨立連線分頁讀取資料，透過有上限的 queue 逐筆交給預測端
+    記憶體中最多只保留 prefetch_pages + 1 頁資料
     """
-    conn = connect_to_db()
-    if not conn:
-        return
+    pages = queue.Queue(maxsize=prefetch_pages)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
 
+    def reader():
+        # 讀取失敗時把例外交給預測端重新拋出，不能當成已讀完，否則呼叫端會以為所有資料都預測完了
+        try:
+            with db_pool.connection() as conn:
+                for page in iter_unlabeled_pages(conn, table_name, text_column, page_size, username, ids):
+                    if not put(page):
+                        return
+        except Exception as e:
+            print(f"讀取 {table_name} 發生錯誤: {e}")
+            put(e)
+        else:
+            put(done)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
     try:
-        with conn.cursor() as cursor:
-            # posts
-            cursor.execute("SELECT id, post_text FROM posts WHERE is_misogyny IS NULL")
-            posts = cursor.fetchall()
-            for post in posts:
-                predict_and_update(post['post_text'], post['id'], 'posts')
-
-            # replies
-            cursor.execute("SELECT id, reply_text FROM replies WHERE is_misogyny IS NULL")
-            replies = cursor.fetchall()
-            for reply in replies:
-                predict_and_update(reply['reply_text'], reply['id'], 'replies')
+        while True:
+            page = pages.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield from page
+    finally:
+        stopped.set()
+
+def score_rows(rows, table_name, text_column, conn, batch_size=BATCH_SIZE, commit_interval=COMMIT_INTERVAL):
+    """
+    以固定大小的批次預測 rows（list 或串流皆可），並透過同一條連線批次寫回資料庫，回傳處理筆數
+    """
+    rows = iter(row for row in rows if row[text_column] is not None)
+    start_time = time.perf_counter()
+    total = 0
+    uncommitted = 0
+    touched_users = set()
+
+    # 一次取多個批次的資料，讓 _infer 能依長度重新分批
+    window_size = batch_size * max(SORT_WINDOW_BATCHES, 1)
+    while True:
+        chunk = list(islice(rows, window_size))
+        if not chunk:
+            break
+        predictions = predict_labels([row[text_column] for row in chunk], batch_size=batch_size, conn=conn)
+        uncommitted += write_predictions(conn, table_name, [
+            (row['id'], label, confidence)
+            for row, (label, confidence) in zip(chunk, predictions)
+        ])
+        touched_users.update(row['username'] for row in chunk)
+        total += len(chunk)
+        if uncommitted >= commit_interval:
+            conn.commit()
+            invalidate_user_stats(touched_users)
+            touched_users.clear()
+            uncommitted = 0
+
+    conn.commit()
+    invalidate_user_stats(touched_users)
+
+    elapsed = time.perf_counter() - start_time
+    if total:
+        print(f"⚡ {table_name}: {total} 筆，{total / elapsed:.1f} texts/sec，"
+              f"預測快取命中率 {prediction_cache_stats()['hit_rate']:.1%}，"
+              f"padding 效率 {padding_efficiency():.1%}")
+    return total
+
+
+# 執行全部的 function
+def process_posts(batch_size=BATCH_SIZE, commit_interval=COMMIT_INTERVAL, stream=True, username=None, ids=None):
+    """
+    自動處理資料庫中尚未預測的 posts 和 replies
+    整個流程共用一條從連線池取得的連線寫回結果
+    stream=True 時以分頁串流讀取待預測資料，記憶體用量不隨資料量增加
+    username 只處理該帳號的資料；ids（{'posts': [...], 'replies': [...]}，例如 save_to_db 的回傳值）
+    只處理指定的資料列。兩者皆未指定時處理整個資料庫；回傳預測的筆數
+    """
+    total = 0
+    with db_pool.connection() as conn:
+        for table_name, text_column in SCORED_TABLES:
+            table_ids = ids.get(table_name, []) if ids is not None else None
+            if stream:
+                rows = stream_unlabeled(table_name, text_column, username=username, ids=table_ids)
+            else:
+                rows = [
+                    row
+                    for page in iter_unlabeled_pages(conn, table_name, text_column, username=username, ids=table_ids)
+                    for row in page
+                ]
+            total += score_rows(rows, table_name, text_column, conn, batch_size, commit_interval)
 
         print("✅ 所有資料已預測並更新完畢！")
-    finally:
-        close_db_connection(conn)
-
-
-def get_post_stats_and_misogynistic_texts(username):
-    # 連接到MySQL數據庫
-    connection = pymysql.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
+    return total
+
+
+def invalidate_user_stats(usernames):
+    """
+    清除這些帳號的統計快取
+    """
+    usernames = [username for username in set(usernames) if username]
+    if usernames:
+        stats_cache.delete(*usernames)
+
 
+def get_post_stats(username):
+    """
+    回傳帳號的 {'total_posts', 'misogynistic_posts'}（貼文 + 回覆）
+    """
+    # 先查快取
+    cached = stats_cache.get(username)
+    if cached is not None:
+        return cached['stats']
+
+    # 從連線池取得MySQL連線，查 user_stats 彙總表（主鍵查詢）
+    with db_pool.connection() as connection:
+        stats = get_user_stats(connection, username)
+    stats_cache.set(username, {'stats': stats})
+    return stats
+
+
+def encode_flagged_cursor(item, column):
+    """
+    把一頁最後一筆的排序值編成不透明的分頁 cursor（包含排序欄位，換了排序就不能沿用）
+    """
+    value = item[column]
+    payload = [column, value if isinstance(value, (int, float)) else value.isoformat(), item['rank'], item['id']]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_flagged_cursor(cursor, column):
+    """
+    解出 (排序值, 資料表順位, id)；cursor 格式錯誤、型別不符或不是這個排序欄位的 cursor 時拋出 ValueError
+    排序值直接放進 SQL，必須是數字（confidence）或 datetime（created_at），不能是 list / dict
+    """
     try:
-        with connection.cursor() as cursor:
-            # 獲取該用戶的總帖子數和厌女帖子的數量
-            cursor.execute("""
-                SELECT 
-                    SUM(total) AS total_posts,
-                    SUM(misogynistic) AS misogynistic_posts
-                FROM (
-                    SELECT COUNT(*) AS total,
-                           SUM(CASE WHEN is_misogyny = TRUE THEN 1 ELSE 0 END) AS misogynistic
-                    FROM posts WHERE username = %s
-                    UNION ALL
-                    SELECT COUNT(*) AS total,
-                           SUM(CASE WHEN is_misogyny = TRUE THEN 1 ELSE 0 END) AS misogynistic
-                    FROM replies WHERE username = %s
-                ) AS combined;
-            """, (username, username))
-            stats = cursor.fetchone()
-
-            # 獲取所有符合厌女標準的帖子文本和回覆文本
-            cursor.execute("""
-                SELECT post_text AS text FROM posts 
-                WHERE username = %s AND is_misogyny = TRUE
-                UNION ALL
-                SELECT reply_text AS text FROM replies
-                WHERE username = %s AND is_misogyny = TRUE;
-            """, (username, username))
-            posts = cursor.fetchall()
-
-            # 返回統計數據和符合條件的帖子文本
-            return stats, posts
+        cursor_column, value, rank, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if cursor_column != column:
+            raise ValueError(f"cursor 的排序欄位 {cursor_column} 與 {column} 不符")
+        if column == 'created_at':
+            value = datetime.fromisoformat(value)
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"排序值必須是數字：{value!r}")
+        if isinstance(rank, bool) or not isinstance(rank, int) or not 0 <= rank < len(SCORED_TABLES):
+            raise ValueError(f"無效的資料表順位：{rank!r}")
+        if isinstance(row_id, bool) or not isinstance(row_id, int):
+            raise ValueError(f"無效的 id：{row_id!r}")
+        return value, rank, row_id
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"無效的 cursor: {cursor}") from e
 
-    finally:
-        # 關閉數據庫連接
-        connection.close()
+
+def get_misogynistic_texts_page(conn, username, order='confidence', cursor=None, limit=FLAGGED_PAGE_SIZE):
+    """
+    以 keyset pagination 取得一頁厭女貼文與回覆，回傳 (items, next_cursor)
+    排序為 (排序欄位 DESC, 資料表, id DESC)；cursor 為上一頁回傳的 next_cursor，沒有下一頁時 next_cursor 為 None
+    """
+    column = FLAGGED_ORDERS[order]
+    position = decode_flagged_cursor(cursor, column) if cursor else None
+
+    items = []
+    for rank, (table_name, text_column) in enumerate(SCORED_TABLES):
+        params = [username]
+        keyset = ""
+        if position is not None:
+            value, cursor_rank, cursor_id = position
+            # 排序值相同時，排在 cursor 所屬資料表之後的資料表全部都還沒出現過
+            if rank > cursor_rank:
+                keyset = f"AND {column} <= %s"
+                params.append(value)
+            elif rank == cursor_rank:
+                keyset = f"AND ({column} < %s OR ({column} = %s AND id < %s))"
+                params.extend((value, value, cursor_id))
+            else:
+                keyset = f"AND {column} < %s"
+                params.append(value)
+        params.append(limit + 1)
+
+        with conn.cursor() as db_cursor:
+            db_cursor.execute(f"""
+                SELECT id, {text_column} AS text, confidence, created_at FROM {table_name}
+                WHERE username = %s AND is_misogyny = TRUE AND {column} IS NOT NULL {keyset}
+                ORDER BY {column} DESC, id DESC
+                LIMIT %s
+            """, params)
+            for row in db_cursor.fetchall():
+                row.update(rank=rank, source=table_name)
+                items.append(row)
+
+    items.sort(key=lambda item: (item[column], -item['rank'], item['id']), reverse=True)
+    page = items[:limit]
+    next_cursor = encode_flagged_cursor(page[-1], column) if len(items) > limit else None
+    return page, next_cursor
@@ -0,0 +1,118 @@
+# app/models/inference_server.py
+
+"""
+獨立的推論伺服器：模型權重只在主程序載入一次，再 fork 出多個 worker 共用同一份權重（copy-on-write），
+各 worker 在同一個 Unix socket 上接受批次推論請求。推論後端（ONNX Runtime session、量化模型）
+在 fork 之後由各 worker 自己建立，不與其他程序共用執行緒池。
+
+用法：
+    INFERENCE_SERVER_SOCKET=/tmp/misogyny-inference.sock python -m app.models.inference_server
+
+web worker 設定同一個 INFERENCE_SERVER_SOCKET 後，load_model 不再載入權重，推論改送到這裡。
+"""
+
+import os
+import signal
+import socket
+import sys
+
+import torch
+
+from app.models import detector
+from app.models.ipc import send_message, recv_message
+
+SOCKET_PATH = os.getenv('INFERENCE_SERVER_SOCKET', '/tmp/misogyny-inference.sock')
+WORKERS = int(os.getenv('INFERENCE_WORKERS', max(1, (os.cpu_count() or 1) // 2)))
+# 每個 worker 使用的 torch 執行緒數，預設把 CPU 平均分給各 worker
+THREADS_PER_WORKER = int(os.getenv('INFERENCE_THREADS_PER_WORKER', max(1, (os.cpu_count() or 1) // WORKERS)))
+
+
+def _handle(message):
+    op = message.get('op')
+    if op == 'version':
+        return {'version': detector.model_version}
+    if op == 'infer':
+        texts = message['texts']
+        batch_size = message.get('batch_size', detector.BATCH_SIZE)
+        return {'predictions': detector._infer(texts, batch_size)}
+    return {'error': f"未知的操作: {op}"}
+
+
+def _serve(listener):
+    # fork 之後才設定執行緒數並建立推論後端：fork 前不能跑過推論或建立 ONNX Runtime session，
+    # 否則子程序繼承到的執行緒池可能卡死；ONNX 匯出也會執行一次模型，同樣留到這裡（以檔案鎖只匯出一次）
+    torch.set_num_threads(THREADS_PER_WORKER)
+    detector.init_backend()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        conn, _ = listener.accept()
+        with conn:
+            while True:
+                try:
+                    message = recv_message(conn)
+                except (OSError, ValueError) as e:
+                    print(f"[{os.getpid()}] 讀取請求失敗: {e}")
+                    break
+                if message is None:
+                    break
+                try:
+                    response = _handle(message)
+                except Exception as e:
+                    response = {'error': str(e)}
+                try:
+                    send_message(conn, response)
+                except OSError:
+                    break
+
+
+def _spawn(listener):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _serve(listener)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main():
+    # 伺服器本身必須在本地載入模型；主程序只載入權重
+    detector.INFERENCE_SERVER_SOCKET = None
+    detector.load_model(init_inference_backend=False)
+    if detector.INFERENCE_BACKEND == 'onnx' and detector.onnxruntime is None:
+        # 後端在 worker 內才建立，缺少套件時先在這裡失敗，避免 worker 不斷重啟
+        raise RuntimeError("INFERENCE_BACKEND=onnx 需要安裝 onnxruntime")
+
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(SOCKET_PATH)
+    listener.listen(128)
+
+    children = {_spawn(listener) for _ in range(WORKERS)}
+    print(f"✅ 推論伺服器已啟動：{SOCKET_PATH}（{WORKERS} 個 worker，各 {THREADS_PER_WORKER} 個執行緒）")
+
+    def shutdown(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # 有 worker 結束時補上新的
+    while True:
+        pid, status = os.wait()
+        if pid in children:
+            children.remove(pid)
+            print(f"⚠ 推論 worker {pid} 結束（狀態 {status}），重新啟動")
+            children.add(_spawn(listener))
+
+
+if __name__ == "__main__":
+    main()
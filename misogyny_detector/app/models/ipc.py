@@ -0,0 +1,54 @@
+# app/models/ipc.py
+
+import json
+import socket
+import struct
+
+# 訊息格式：4 bytes 長度（big-endian）+ UTF-8 JSON
+_HEADER = struct.Struct('!I')
+
+
+def send_message(sock, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    """
+    讀取一則訊息；對方關閉連線時回傳 None
+    """
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def request(socket_path, payload, timeout=300):
+    """
+    連到推論伺服器送出一個請求並等待回應
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        send_message(sock, payload)
+        response = recv_message(sock)
+    if response is None:
+        raise ConnectionError("推論伺服器提前關閉連線")
+    if 'error' in response:
+        raise RuntimeError(f"推論伺服器錯誤: {response['error']}")
+    return response
@@ -0,0 +1,320 @@
+# app/models/schema.py
+
+"""
+資料庫 schema 與版本化 migration
+
+已套用的版本記錄在 schema_migrations；每個 migration 只執行一次，且可以重複套用在
+已手動建立資料表的舊資料庫上（CREATE TABLE IF NOT EXISTS、索引不存在時才新增）。
+多個 worker 同時啟動時以 GET_LOCK 確保只有一個在執行 migration。
+
+用法：
+    python -m app.models.schema            # 套用尚未執行的 migration
+    python -m app.models.schema --status   # 列出目前版本
+    python -m app.models.schema --explain  # 以 EXPLAIN 檢查熱門查詢是否用到索引
+"""
+
+import argparse
+import os
+import sys
+
+from app.models.db import db_pool
+from app.models.user_stats import rebuild_user_stats
+
+# create_app 啟動時自動套用 migration；設為 0 時需手動執行
+SCHEMA_AUTO_MIGRATE = os.getenv('SCHEMA_AUTO_MIGRATE', '1') != '0'
+_LOCK_NAME = 'misogyny_schema_migrations'
+_LOCK_TIMEOUT = 60
+
+
+def _create_base_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS profiles (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            full_name VARCHAR(255) NULL,
+            bio TEXT NULL,
+            followers INT NULL,
+            url VARCHAR(512) NULL,
+            UNIQUE KEY uq_profiles_username (username)
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS posts (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            post_id VARCHAR(64) NOT NULL,
+            post_text TEXT NULL,
+            post_url VARCHAR(512) NULL,
+            created_at DATETIME NULL,
+            is_misogyny TINYINT(1) NULL,
+            confidence FLOAT NULL,
+            UNIQUE KEY uq_posts_post_id (post_id)
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS replies (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            post_id VARCHAR(64) NOT NULL,
+            username VARCHAR(255) NOT NULL,
+            reply_id VARCHAR(64) NOT NULL,
+            reply_text TEXT NULL,
+            reply_url VARCHAR(512) NULL,
+            created_at DATETIME NULL,
+            is_misogyny TINYINT(1) NULL,
+            confidence FLOAT NULL,
+            UNIQUE KEY uq_replies_reply_id (reply_id)
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+
+
+def _add_hot_query_indexes(cursor):
+    for table in ('posts', 'replies'):
+        code_column = 'post_id' if table == 'posts' else 'reply_id'
+        # 重複偵測（_ids_by_code / ON DUPLICATE KEY）
+        _add_index(cursor, table, f"uq_{table}_{code_column}", [code_column], unique=True)
+        # 待預測資料的 keyset 掃描：WHERE is_misogyny IS NULL AND id > ? ORDER BY id
+        _add_index(cursor, table, f"idx_{table}_backlog", ['is_misogyny', 'id'])
+        # 單一帳號的統計、厭女文列表與待預測資料：WHERE username = ? AND is_misogyny ...
+        _add_index(cursor, table, f"idx_{table}_user_label", ['username', 'is_misogyny', 'id'])
+    _add_index(cursor, 'replies', 'idx_replies_post_id', ['post_id'])
+    _add_index(cursor, 'profiles', 'uq_profiles_username', ['username'], unique=True)
+
+
+def _create_support_tables(cursor):
+    # 增量爬取狀態（crawler）與預測結果快取（detector）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_state (
+            username VARCHAR(255) NOT NULL PRIMARY KEY,
+            last_crawled_at DATETIME NOT NULL
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_threads (
+            post_code VARCHAR(255) NOT NULL PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            reply_count INT NULL,
+            replies_crawled_at DATETIME NOT NULL,
+            KEY idx_crawl_threads_username (username)
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS prediction_cache (
+            text_hash CHAR(64) NOT NULL PRIMARY KEY,
+            model_version VARCHAR(64) NOT NULL,
+            label TINYINT NOT NULL,
+            confidence FLOAT NOT NULL
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+
+
+def _create_user_stats(cursor):
+    # 每個帳號的統計彙總（見 app.models.user_stats），建立後以現有資料回填
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            username VARCHAR(255) NOT NULL PRIMARY KEY,
+            posts_total INT NOT NULL DEFAULT 0,
+            posts_misogynistic INT NOT NULL DEFAULT 0,
+            replies_total INT NOT NULL DEFAULT 0,
+            replies_misogynistic INT NOT NULL DEFAULT 0
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+    rebuild_user_stats(cursor)
+
+
+def _add_flagged_page_indexes(cursor):
+    # 厭女文列表的 keyset 分頁：WHERE username = ? AND is_misogyny = TRUE ORDER BY confidence / created_at DESC, id DESC
+    for table in ('posts', 'replies'):
+        _add_index(cursor, table, f"idx_{table}_flagged_confidence", ['username', 'is_misogyny', 'confidence', 'id'])
+        _add_index(cursor, table, f"idx_{table}_flagged_recent", ['username', 'is_misogyny', 'created_at', 'id'])
+
+
+def _widen_confidence(cursor):
+    # FLOAT 讀回 Python 後是 float32 值的十進位表示，再拿來比較時 MySQL 以 double 比較，
+    # keyset 分頁的 confidence = ? 永遠不成立；改成 DOUBLE 讓讀回的值可以原樣比較
+    for table in ('posts', 'replies'):
+        cursor.execute(f"ALTER TABLE {table} MODIFY confidence DOUBLE NULL")
+    cursor.execute("ALTER TABLE prediction_cache MODIFY confidence DOUBLE NOT NULL")
+
+
+def _drop_duplicate_indexes(cursor):
+    # migration 2 原本只以名稱判斷索引是否存在，舊資料庫上既有的同欄位索引又被重複建立了一份；
+    # 保留原本的索引，刪除我們加上的 uq_ / idx_ 重複索引
+    for table in ('profiles', 'posts', 'replies'):
+        indexes = _indexes(cursor, table)
+        ours = {name for name in indexes if name.startswith(('uq_', 'idx_'))}
+        for name in sorted(ours):
+            columns, unique = indexes[name]
+            if any(
+                other not in ours and other_columns == columns and other_unique == unique
+                for other, (other_columns, other_unique) in indexes.items()
+            ):
+                cursor.execute(f"ALTER TABLE {table} DROP INDEX {name}")
+
+
+# (版本, 說明, 套用函式)；只能往後新增，不可修改已發布的 migration
+MIGRATIONS = [
+    (1, 'create profiles, posts and replies', _create_base_tables),
+    (2, 'indexes for backlog scan, per-user stats and duplicate detection', _add_hot_query_indexes),
+    (3, 'crawl state and prediction cache tables', _create_support_tables),
+    (4, 'per-user stats rollup', _create_user_stats),
+    (5, 'indexes for paginated flagged texts', _add_flagged_page_indexes),
+    (6, 'store confidence as DOUBLE', _widen_confidence),
+    (7, 'drop indexes duplicating legacy ones', _drop_duplicate_indexes),
+]
+
+
+def _indexes(cursor, table):
+    """
+    回傳資料表的索引 {名稱: (欄位 tuple, 是否 unique)}
+    """
+    cursor.execute("""
+        SELECT index_name AS name, column_name AS column_name, non_unique AS non_unique
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    """, (table,))
+    indexes = {}
+    for row in cursor.fetchall():
+        columns, unique = indexes.get(row['name'], ((), True))
+        indexes[row['name']] = (columns + (row['column_name'],), unique and not int(row['non_unique']))
+    return indexes
+
+
+def _add_index(cursor, table, name, columns, unique=False):
+    """
+    同名索引或相同欄位的索引（需要 unique 時也必須是 unique）不存在時才新增
+    舊資料庫可能已有名稱不同的同一個索引，例如 UNIQUE KEY post_id (post_id)
+    """
+    for existing, (existing_columns, existing_unique) in _indexes(cursor, table).items():
+        if existing == name or (existing_columns == tuple(columns) and (existing_unique or not unique)):
+            return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(columns)})")
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+
+
+def current_version(conn):
+    with conn.cursor() as cursor:
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+        row = cursor.fetchone()
+    return row['version'] or 0
+
+
+def migrate(conn=None):
+    """
+    依序套用尚未執行的 migration，回傳這次套用的版本
+    """
+    if conn is None:
+        with db_pool.connection() as conn:
+            return migrate(conn)
+
+    applied = []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s) AS locked", (_LOCK_NAME, _LOCK_TIMEOUT))
+        if not cursor.fetchone()['locked']:
+            raise RuntimeError("等待其他程序執行 migration 逾時")
+        try:
+            version = current_version(conn)
+            for number, description, apply in MIGRATIONS:
+                if number <= version:
+                    continue
+                print(f"🔧 套用 migration {number}: {description}")
+                apply(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (number, description)
+                )
+                conn.commit()
+                applied.append(number)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+    return applied
+
+
+# 熱門查詢與預期使用的索引（以開頭欄位表示，舊資料庫上同欄位的索引名稱可能不同），供 EXPLAIN 檢查
+# 帳號統計改由 user_stats 以主鍵查詢，posts / replies 上的統計只在重建彙總表時執行，不列入
+HOT_QUERIES = [
+    (table, name, sql, params, columns)
+    for table, text_column, code_column in (('posts', 'post_text', 'post_id'), ('replies', 'reply_text', 'reply_id'))
+    for name, sql, params, columns in (
+        ('backlog scan',
+         f"SELECT id, username, {text_column} FROM {table} WHERE is_misogyny IS NULL AND id > %s ORDER BY id LIMIT 1000",
+         (0,), ('is_misogyny', 'id')),
+        ('user backlog scan',
+         f"SELECT id, username, {text_column} FROM {table} "
+         f"WHERE is_misogyny IS NULL AND id > %s AND username = %s ORDER BY id LIMIT 1000",
+         (0, 'x'), ('username', 'is_misogyny', 'id')),
+        # 與 get_misogynistic_texts_page 的兩種排序相同
+        ('flagged page (confidence)',
+         f"SELECT id, {text_column} FROM {table} WHERE username = %s AND is_misogyny = TRUE "
+         f"AND confidence IS NOT NULL AND (confidence < %s OR (confidence = %s AND id < %s)) "
+         f"ORDER BY confidence DESC, id DESC LIMIT 51",
+         ('x', 1.0, 1.0, 0), ('username', 'is_misogyny', 'confidence', 'id')),
+        ('flagged page (recent)',
+         f"SELECT id, {text_column} FROM {table} WHERE username = %s AND is_misogyny = TRUE "
+         f"AND created_at IS NOT NULL AND (created_at < %s OR (created_at = %s AND id < %s)) "
+         f"ORDER BY created_at DESC, id DESC LIMIT 51",
+         ('x', '2100-01-01 00:00:00', '2100-01-01 00:00:00', 0), ('username', 'is_misogyny', 'created_at', 'id')),
+        ('duplicate detection',
+         f"SELECT id, {code_column} FROM {table} WHERE {code_column} IN (%s, %s)",
+         ('a', 'b'), (code_column,)),
+    )
+]
+
+
+def check_query_plans(conn=None):
+    """
+    對熱門查詢執行 EXPLAIN，回傳 [(table, 查詢名稱, 預期的索引欄位, 實際使用的索引, 是否通過)]
+    實際使用的索引（EXPLAIN 的 key）必須以預期欄位開頭才算通過；
+    資料量很少時優化器會選擇全表掃描，請在有代表性資料並執行過 ANALYZE TABLE 的資料庫上檢查
+    """
+    if conn is None:
+        with db_pool.connection() as conn:
+            return check_query_plans(conn)
+
+    results = []
+    with conn.cursor() as cursor:
+        indexes = {table: _indexes(cursor, table) for table in {query[0] for query in HOT_QUERIES}}
+        for table, name, sql, params, columns in HOT_QUERIES:
+            cursor.execute(f"EXPLAIN {sql}", params)
+            plan = next((row for row in cursor.fetchall() if row.get('table') == table), {})
+            key = plan.get('key')
+            ok = key in indexes[table] and indexes[table][key][0][:len(columns)] == columns
+            results.append((table, name, ', '.join(columns), key, ok))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="database schema migrations")
+    parser.add_argument("--status", action="store_true", help="show the current schema version")
+    parser.add_argument("--explain", action="store_true", help="check that the hot queries can use their indexes")
+    args = parser.parse_args()
+
+    if args.status:
+        with db_pool.connection() as conn:
+            print(f"schema 版本 {current_version(conn)}（最新 {MIGRATIONS[-1][0]}）")
+        return
+
+    if args.explain:
+        failed = False
+        for table, name, columns, key, ok in check_query_plans():
+            print(f"{'✅' if ok else '❌'} {table:<8} {name:<26} 預期 ({columns:<36}) 實際 {key}")
+            failed = failed or not ok
+        sys.exit(1 if failed else 0)
+
+    applied = migrate()
+    print(f"✅ 已套用 migration {applied}" if applied else "✅ schema 已是最新版本")
+
+
+if __name__ == "__main__":
+    main()
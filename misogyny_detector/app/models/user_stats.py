@@ -0,0 +1,118 @@
+# app/models/user_stats.py
+
+"""
+每個帳號的統計彙總表 user_stats：貼文與回覆各自的總數與厭女數
+
+save_to_db 新增資料列、write_predictions 寫入預測結果時，在同一個交易內增量更新，
+查詢統計只需要一次主鍵查詢。與原始資料不一致時可以重建：
+
+    python -m app.models.user_stats --rebuild [--username USERNAME]
+"""
+
+import argparse
+
+import pymysql
+
+from app.models.db import db_pool
+
+# 可彙總的資料表
+STATS_TABLES = ('posts', 'replies')
+
+
+def record_inserted_rows(cursor, table_name, ids):
+    """
+    把新增的資料列加進各帳號的總數（新資料尚未預測，不影響厭女數）
+    """
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"""
+            INSERT INTO user_stats (username, {table_name}_total)
+            SELECT username, COUNT(*) FROM {table_name} WHERE id IN ({placeholders}) GROUP BY username
+            ON DUPLICATE KEY UPDATE {table_name}_total = {table_name}_total + VALUES({table_name}_total)
+        """, chunk)
+
+
+def record_label_changes(conn, table_name, predictions):
+    """
+    依 predictions（[(id, label, confidence), ...]）與資料列原本的標籤，調整各帳號的厭女數
+    必須在寫入新標籤之前、同一個交易內呼叫；FOR UPDATE 讓同時寫入的交易不會重複計算
+    """
+    labels = {row_id: label for row_id, label, _ in predictions}
+    placeholders = ", ".join(["%s"] * len(labels))
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(
+            f"SELECT id, username, is_misogyny FROM {table_name} WHERE id IN ({placeholders}) FOR UPDATE",
+            list(labels)
+        )
+        deltas = {}
+        for row in cursor.fetchall():
+            delta = int(labels[row['id']] == 1) - int(row['is_misogyny'] == 1)
+            if delta:
+                deltas[row['username']] = deltas.get(row['username'], 0) + delta
+
+        if deltas:
+            cursor.executemany(f"""
+                INSERT INTO user_stats (username, {table_name}_misogynistic) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE {table_name}_misogynistic = {table_name}_misogynistic + VALUES({table_name}_misogynistic)
+            """, list(deltas.items()))
+
+
+def get_user_stats(conn, username):
+    """
+    回傳 {'total_posts': ..., 'misogynistic_posts': ...}（貼文 + 回覆）
+    """
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("""
+            SELECT posts_total + replies_total AS total_posts,
+                   posts_misogynistic + replies_misogynistic AS misogynistic_posts
+            FROM user_stats WHERE username = %s
+        """, (username,))
+        row = cursor.fetchone()
+    if row is None:
+        return {'total_posts': 0, 'misogynistic_posts': 0}
+    return {key: int(value) for key, value in row.items()}
+
+
+def rebuild_user_stats(cursor, username=None):
+    """
+    從 posts / replies 重新計算彙總表；未指定 username 時重建全部（不 commit）
+    """
+    user_filter = "WHERE username = %s" if username else ""
+    params = (username, username) if username else ()
+    cursor.execute(f"DELETE FROM user_stats {user_filter}", (username,) if username else ())
+    cursor.execute(f"""
+        INSERT INTO user_stats (username, posts_total, posts_misogynistic, replies_total, replies_misogynistic)
+        SELECT username, SUM(posts_total), SUM(posts_misogynistic), SUM(replies_total), SUM(replies_misogynistic)
+        FROM (
+            SELECT username, COUNT(*) AS posts_total,
+                   SUM(CASE WHEN is_misogyny = TRUE THEN 1 ELSE 0 END) AS posts_misogynistic,
+                   0 AS replies_total, 0 AS replies_misogynistic
+            FROM posts {user_filter} GROUP BY username
+            UNION ALL
+            SELECT username, 0, 0, COUNT(*), SUM(CASE WHEN is_misogyny = TRUE THEN 1 ELSE 0 END)
+            FROM replies {user_filter} GROUP BY username
+        ) AS combined
+        GROUP BY username
+    """, params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="user_stats rollup maintenance")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollup from posts and replies")
+    parser.add_argument("--username", help="only rebuild this account")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            rebuild_user_stats(cursor, args.username)
+        conn.commit()
+    print(f"✅ 已重建 {args.username or '所有帳號'} 的 user_stats")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# parse benchmark
+
+"""
+比較 parse_thread 的速度：每次重新解析 JMESPath 字串 vs. 預先編譯 vs. 精簡模式
+
+用法：
+    python -m app.threads.benchmark [thread_items.json] [--repeat N]
+
+thread_items.json 為錄下來的 thread item 陣列（即 nested_lookup("thread_items", ...) 攤平後的內容）；
+未提供時使用產生的樣本資料。
+"""
+
+import argparse
+import json
+import time
+
+import jmespath
+
+from app.threads.crawler import THREAD_EXPRESSION, parse_thread
+
+# 舊版 parse_thread 的做法：每次呼叫都把運算式字串交給 jmespath.search
+_THREAD_EXPRESSION_SOURCE = THREAD_EXPRESSION.expression
+
+
+def _parse_thread_uncompiled(data):
+    result = jmespath.search(_THREAD_EXPRESSION_SOURCE, data)
+    result["videos"] = list(set(result["videos"] or []))
+    if result["reply_count"] and type(result["reply_count"]) != int:
+        result["reply_count"] = int(result["reply_count"].split(" ")[0])
+    result["url"] = f"https://www.threads.net/@{result['username']}/post/{result['code']}"
+    keys_to_keep = ["text", "code", "username", "url"]
+    return {key: result[key] for key in keys_to_keep if key in result}
+
+
+def _sample_thread_items(count=500):
+    return [
+        {
+            "post": {
+                "caption": {"text": f"測試貼文 {i} " * 5},
+                "taken_at": 1700000000 + i,
+                "id": f"{i}_1",
+                "pk": str(i),
+                "code": f"C{i:08d}",
+                "user": {
+                    "username": f"user{i % 20}",
+                    "profile_pic_url": f"https://example.com/{i}.jpg",
+                    "is_verified": False,
+                    "pk": str(i % 20),
+                    "id": str(i % 20),
+                },
+                "has_audio": False,
+                "like_count": i,
+                "carousel_media": None,
+                "carousel_media_count": None,
+                "video_versions": [],
+            },
+            "view_replies_cta_string": f"{i % 7} replies",
+        }
+        for i in range(count)
+    ]
+
+
+def _measure(parse, items, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            parse(item)
+    elapsed = time.perf_counter() - start_time
+    return len(items) * repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parse_thread micro-benchmark")
+    parser.add_argument("payloads", nargs="?", help="recorded thread items (JSON array)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.payloads:
+        with open(args.payloads, encoding="utf-8") as f:
+            items = json.load(f)
+    else:
+        items = _sample_thread_items()
+
+    cases = [
+        ("uncompiled (old)", _parse_thread_uncompiled),
+        ("compiled full", lambda item: parse_thread(item, lean=False)),
+        ("compiled lean", parse_thread),
+    ]
+    baseline = None
+    for name, parse in cases:
+        rate = _measure(parse, items, args.repeat)
+        baseline = baseline or rate
+        print(f"{name:<18} {rate:>12,.0f} items/sec  ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# browser pool
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+
+try:
+    import psutil
+except ImportError:  # 沒有 psutil 時只依頁數回收瀏覽器
+    psutil = None
+
+# 同時保持溫啟動的 Chromium 數量、同時借出的 context 上限
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 1))
+BROWSER_MAX_CONTEXTS = int(os.getenv('BROWSER_MAX_CONTEXTS', 4))
+# 每個 Chromium 開過多少頁面或佔用多少記憶體（MB）後回收重開
+BROWSER_MAX_PAGES = int(os.getenv('BROWSER_MAX_PAGES', 200))
+BROWSER_MAX_MEMORY_MB = int(os.getenv('BROWSER_MAX_MEMORY_MB', 1024))
+
+VIEWPORT = {"width": 1920, "height": 1080}
+
+
+def _chromium_root_pids() -> set:
+    """Return the pids of top-level Chromium processes started by this process."""
+    if psutil is None:
+        return set()
+    pids = set()
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            if "chrom" in proc.name().lower() and "chrom" not in proc.parent().name().lower():
+                pids.add(proc.pid)
+        except psutil.Error:
+            continue
+    return pids
+
+
+def _process_tree_rss_mb(pid: int) -> float:
+    if psutil is None or pid is None:
+        return 0.0
+    try:
+        root = psutil.Process(pid)
+        procs = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return 0.0
+    rss = 0
+    for proc in procs:
+        try:
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    return rss / (1024 * 1024)
+
+
+class _BrowserSlot:
+    def __init__(self, browser, pid):
+        self.browser = browser
+        self.pid = pid
+        self.launched_at = time.time()
+        self.pages_served = 0
+        self.active_contexts = 0
+        self.retired = False
+
+    def healthy(self) -> bool:
+        return not self.retired and self.browser.is_connected()
+
+    def memory_mb(self) -> float:
+        return _process_tree_rss_mb(self.pid)
+
+
+class BrowserPool:
+    """Keep Chromium instances warm on a dedicated event loop and lend out contexts.
+
+    Playwright objects are bound to the event loop that created them, so every
+    browser lives on one background loop thread; callers in other threads submit
+    coroutines through run().
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_contexts=BROWSER_MAX_CONTEXTS,
+                 max_pages=BROWSER_MAX_PAGES, max_memory_mb=BROWSER_MAX_MEMORY_MB):
+        self.size = size
+        self.max_contexts = max_contexts
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self._lock = threading.Lock()
+        self._loop = None
+        self._playwright = None
+        self._slots = []
+        self._context_limit = None
+        self._launch_lock = None
+        self._launched = 0
+        self._recycled = 0
+
+    # ----- 執行緒端介面 -----
+
+    def run(self, coro_fn, *args, **kwargs):
+        """Run coro_fn(*args, **kwargs) on the browser loop and block until it finishes."""
+        return self.submit(coro_fn, *args, **kwargs).result()
+
+    def submit(self, coro_fn, *args, **kwargs):
+        """Schedule coro_fn(*args, **kwargs) on the browser loop and return a concurrent Future."""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro_fn(*args, **kwargs), self._loop)
+
+    def stats(self) -> dict:
+        """Return a snapshot of the pool for health checks."""
+        if self._loop is None:
+            return {"started": False}
+        return self.run(self._stats)
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="browser-pool", daemon=True)
+            thread.start()
+            try:
+                asyncio.run_coroutine_threadsafe(self._start(), loop).result()
+            except BaseException:
+                # 啟動失敗：關閉已啟動的瀏覽器並停止事件迴圈，下次呼叫時重新啟動
+                try:
+                    asyncio.run_coroutine_threadsafe(self._close(), loop).result()
+                except Exception as e:
+                    print(f"關閉瀏覽器池失敗: {e}")
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+                raise
+            self._loop = loop
+        print(f"✅ 瀏覽器池已啟動（{self.size} 個 Chromium，最多 {self.max_contexts} 個 context）")
+        if psutil is None and self.max_memory_mb > 0:
+            print(f"⚠ 未安裝 psutil，BROWSER_MAX_MEMORY_MB={self.max_memory_mb} 不會生效，只依頁數回收瀏覽器")
+
+    # ----- 事件迴圈端 -----
+
+    async def _start(self):
+        self._playwright = await async_playwright().start()
+        self._context_limit = asyncio.Semaphore(self.max_contexts)
+        self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            for _ in range(self.size):
+                await self._launch()
+
+    async def _launch(self) -> _BrowserSlot:
+        # 呼叫端必須持有 _launch_lock，前後的 pid 比對才不會混到同時啟動的其他瀏覽器
+        # psutil 會讀 /proc，交給執行緒以免卡住事件迴圈
+        before = await asyncio.to_thread(_chromium_root_pids)
+        browser = await self._playwright.chromium.launch()
+        new_pids = await asyncio.to_thread(_chromium_root_pids) - before
+        slot = _BrowserSlot(browser, new_pids.pop() if len(new_pids) == 1 else None)
+        browser.on("disconnected", lambda _: setattr(slot, "retired", True))
+        self._slots.append(slot)
+        self._launched += 1
+        return slot
+
+    async def _checkout_slot(self) -> _BrowserSlot:
+        # 健康檢查：移除斷線或已退役且沒有借出 context 的瀏覽器
+        for slot in list(self._slots):
+            if not slot.healthy() and slot.active_contexts == 0:
+                await self._retire(slot)
+
+        healthy = [slot for slot in self._slots if slot.healthy()]
+        if len(healthy) < self.size:
+            async with self._launch_lock:
+                # 等鎖期間其他借用者可能已經補上瀏覽器，重新檢查才不會開超過 size 個
+                healthy = [slot for slot in self._slots if slot.healthy()]
+                if len(healthy) < self.size:
+                    return await self._launch()
+        return min(healthy, key=lambda slot: slot.active_contexts)
+
+    async def _retire(self, slot: _BrowserSlot):
+        slot.retired = True
+        if slot in self._slots:
+            self._slots.remove(slot)
+            self._recycled += 1
+        try:
+            await slot.browser.close()
+        except Exception as e:
+            print(f"關閉瀏覽器失敗: {e}")
+
+    async def _should_recycle(self, slot: _BrowserSlot) -> bool:
+        if slot.pages_served >= self.max_pages:
+            return True
+        return self.max_memory_mb > 0 and await asyncio.to_thread(slot.memory_mb) > self.max_memory_mb
+
+    @asynccontextmanager
+    async def context(self):
+        """Borrow a fresh browser context from a warm browser (use on the pool loop)."""
+        async with self._context_limit:
+            slot = await self._checkout_slot()
+            context = await slot.browser.new_context(viewport=VIEWPORT)
+            context.on("page", lambda _: setattr(slot, "pages_served", slot.pages_served + 1))
+            slot.active_contexts += 1
+            try:
+                yield context
+            finally:
+                slot.active_contexts -= 1
+                try:
+                    await context.close()
+                except Exception as e:
+                    print(f"關閉 context 失敗: {e}")
+                if await self._should_recycle(slot):
+                    slot.retired = True
+                if slot.retired and slot.active_contexts == 0:
+                    await self._retire(slot)
+
+    async def _stats(self) -> dict:
+        slots = list(self._slots)
+        memory = await asyncio.to_thread(lambda: [slot.memory_mb() for slot in slots])
+        return {
+            "started": True,
+            "browsers": [
+                {
+                    "connected": slot.browser.is_connected(),
+                    "retired": slot.retired,
+                    "pages_served": slot.pages_served,
+                    "active_contexts": slot.active_contexts,
+                    "memory_mb": round(memory_mb, 1),
+                    "uptime": round(time.time() - slot.launched_at, 1),
+                }
+                for slot, memory_mb in zip(slots, memory)
+            ],
+            "launched": self._launched,
+            "recycled": self._recycled,
+        }
+
+    async def _close(self):
+        for slot in list(self._slots):
+            await self._retire(slot)
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+# 全域共用的瀏覽器池（第一次使用時才啟動）
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
@@ -1,207 +1,432 @@
 # crawl
 
+import asyncio
 import json
+import time
+from collections import defaultdict
 from typing import Dict
+from urllib.parse import urlparse
 import jmespath
 from parsel import Selector
-from playwright.sync_api import sync_playwright
 from nested_lookup import nested_lookup
 import pymysql
 import os
 from dotenv import load_dotenv
+from app.models.db import db_pool
+from app.models.schema import migrate
+from app.models.user_stats import record_inserted_rows
+from app.threads.browser import browser_pool
 
 # 載入 .env 檔案的環境變數
 load_dotenv()
 
+# 同時爬取回覆的頁面數（1 表示逐篇爬取），以及對同一個 host 的最大並行數
+CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', 4))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv('CRAWL_PER_HOST_CONCURRENCY', 4))
+
+# 增量爬取開關；同一帳號在 CRAWL_REFRESH_INTERVAL 秒內重複分析時直接沿用資料庫中的資料
+CRAWL_INCREMENTAL = os.getenv('CRAWL_INCREMENTAL', '1') != '0'
+CRAWL_REFRESH_INTERVAL = int(os.getenv('CRAWL_REFRESH_INTERVAL', 300))
+
+# 爬蟲只需要頁面內嵌的 data-sjs JSON，圖片、影片、字型、樣式表與第三方 host 的請求一律擋掉
+# CRAWL_ALLOWED_HOSTS 留空表示不限制 host；CRAWL_BLOCK_RESOURCES=0 可關閉過濾以比較前後差異
+CRAWL_BLOCK_RESOURCES = os.getenv('CRAWL_BLOCK_RESOURCES', '1') != '0'
+CRAWL_BLOCKED_RESOURCE_TYPES = set(
+    filter(None, os.getenv('CRAWL_BLOCKED_RESOURCE_TYPES', 'image,media,font,stylesheet').split(','))
+)
+CRAWL_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv('CRAWL_ALLOWED_HOSTS', 'threads.net,threads.com,cdninstagram.com').split(',')
+    if host.strip()
+]
+
+# 資料擷取方式：network 直接讀取 data-sjs 內容與 GraphQL/XHR 回應；html 則序列化整個 DOM 再解析
+CRAWL_EXTRACT_MODE = os.getenv('CRAWL_EXTRACT_MODE', 'network')
+SJS_SCRIPT_SELECTOR = 'script[type="application/json"][data-sjs]'
+# 在瀏覽器端先篩選 data-sjs 內容，只把需要的 JSON 傳回 Python
+_SELECT_SJS_SCRIPTS = """(scripts, markers) => scripts
+    .map(script => script.textContent)
+    .filter(text => text.includes('"ScheduledServerJS"') && markers.some(marker => text.includes(marker)))"""
+
 # 測試資料庫連接
 def test_db_connection():
     try:
-        conn = get_db_connection()  # 嘗試連接資料庫
-        print("資料庫連接測試成功！")
+        with db_pool.connection():  # 取出時會先 ping
+            print("資料庫連接測試成功！")
     except Exception as e:
         print(f"資料庫連接測試失敗！錯誤: {e}")
 
-# 1. 連接 MySQL 資料庫
-def get_db_connection():
-    """Return a connection to the MySQL database."""
-    try:
-        conn = pymysql.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME'),
-            charset='utf8mb4'  # 字符集設定
-        )
-        # 檢查資料庫連接是否成功
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1")
-            result = cursor.fetchone()
-            if result:
-                print("資料庫連接成功！")
-            else:
-                print("資料庫連接失敗！")
-                conn.close()
-                raise Exception("資料庫連接失敗！")
-        return conn
-    except Exception as e:
-        print(f"資料庫連接失敗！錯誤: {e}")
-        raise
+# 1. 連接 MySQL 資料庫：連線由 app.models.db 的連線池提供（取出時 pre-ping）
+# 連線池預設使用 DictCursor，這裡的查詢以 tuple 讀取結果
+def _cursor(conn):
+    """Return a tuple cursor on a pooled connection."""
+    return conn.cursor(pymysql.cursors.Cursor)
 
 # 2. 儲存資料到資料庫
-def save_to_db(user_data: dict, threads_data: list):
-    """Store the scraped profile and threads in the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# 每次 IN (...) 查詢與 executemany 最多處理的筆數
+SAVE_CHUNK_SIZE = int(os.getenv('SAVE_CHUNK_SIZE', 500))
+
+
+def _chunks(items: list, size: int = SAVE_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _ids_by_code(cursor, table: str, code_column: str, codes: list) -> dict:
+    """Return {code: id} for the codes that already exist in table."""
+    found = {}
+    for chunk in _chunks(codes):
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"SELECT id, {code_column} FROM {table} WHERE {code_column} IN ({placeholders})", chunk)
+        found.update({code: row_id for row_id, code in cursor.fetchall()})
+    return found
+
+
+def _insert_new_rows(cursor, table: str, code_column: str, rows: list, insert_query: str) -> list:
+    """Bulk insert the rows whose code is not stored yet and return their new ids.
+
+    rows is a list of (code, params); insert_query must be a plain
+    INSERT ... VALUES (%s, ...) so executemany sends multi-row INSERTs.
+    """
+    unique_rows = {}
+    for code, params in rows:
+        unique_rows.setdefault(code, params)
+
+    existing = _ids_by_code(cursor, table, code_column, list(unique_rows))
+    new_codes = [code for code in unique_rows if code not in existing]
+    skipped = len(unique_rows) - len(new_codes)
+    if skipped:
+        print(f"Warning: {skipped} rows already exist in {table}, skipping insert.")
+
+    for chunk in _chunks(new_codes):
+        # ON DUPLICATE KEY 只在與其他爬蟲同時寫入時生效，不會覆蓋既有資料與預測結果
+        cursor.executemany(insert_query, [unique_rows[code] for code in chunk])
+
+    new_ids = _ids_by_code(cursor, table, code_column, new_codes)
+    return [new_ids[code] for code in new_codes if code in new_ids]
+
+
+def save_to_db(user_data: dict, threads_data: list) -> dict:
+    """Store the scraped profile and threads in the database in one transaction.
+
+    Returns the ids of the rows actually inserted, per table:
+    {"posts": [...], "replies": [...]}
+    """
+    conn = db_pool.acquire()
+    cursor = _cursor(conn)
+    inserted_ids = {"posts": [], "replies": []}
 
-    # 儲存使用者資料
     try:
-        user_query = """
-            INSERT INTO profiles (username, full_name, bio, followers, url)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        cursor.execute(
-            user_query, (
-                user_data["username"], 
-                user_data["full_name"], 
-                user_data["bio"], 
-                user_data["followers"], 
-                user_data["url"]
-            )
-        )
-    except pymysql.MySQLError as e:
-        if e.args[0] == 1062:  # Duplicate entry error
-            print(f"Warning: User {user_data['username']} already exists, skipping insert.")
-        else:
-            raise  # Raise other errors
+        # 所有資料共用同一個資料庫時間，讓 VALUES 只含 placeholder，executemany 才能合併成多列 INSERT
+        cursor.execute("SELECT NOW()")
+        now = cursor.fetchone()[0]
 
-    # 儲存每個貼文資料
-    for thread in threads_data:
-        try:
-            post_query = """
-                INSERT INTO posts (username, post_id, post_text, post_url, created_at)
-                VALUES (%s, %s, %s, %s, NOW())
-            """
+        # 儲存使用者資料（已存在則更新）
+        if user_data:
             cursor.execute(
-                post_query, (
-                    thread["username"], 
-                    thread["code"], 
-                    thread["text"], 
-                    thread["url"]
+                """
+                INSERT INTO profiles (username, full_name, bio, followers, url)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    full_name = VALUES(full_name),
+                    bio = VALUES(bio),
+                    followers = VALUES(followers),
+                    url = VALUES(url)
+                """, (
+                    user_data["username"],
+                    user_data["full_name"],
+                    user_data["bio"],
+                    user_data["followers"],
+                    user_data["url"]
                 )
             )
-        except pymysql.MySQLError as e:
-            if e.args[0] == 1062:  # Duplicate entry error
-                print(f"Warning: Post with post_id {thread['code']} already exists, skipping insert.")
-            else:
-                raise  # Raise other errors
+
+        # 儲存每個貼文資料
+        post_rows = [
+            (thread["code"], (thread["username"], thread["code"], thread["text"], thread["url"], now))
+            for thread in threads_data
+        ]
+        inserted_ids["posts"] = _insert_new_rows(cursor, "posts", "post_id", post_rows, """
+            INSERT INTO posts (username, post_id, post_text, post_url, created_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """)
 
         # 儲存回覆資料
-        for reply in thread.get("replies", []):
-            try:
-                reply_query = """
-                    INSERT INTO replies (post_id, username, reply_id, reply_text, reply_url, created_at)
-                    VALUES (%s, %s, %s, %s, %s, NOW())
-                """
-                cursor.execute(
-                    reply_query, (
-                        thread["code"],  # 這裡應該是回覆所對應的貼文 ID
-                        reply["username"], 
-                        reply["code"],  # 這是回覆的 ID
-                        reply["text"], 
-                        reply["url"]
-                    )
-                )
-            except pymysql.MySQLError as e:
-                if e.args[0] == 1062:  # Duplicate entry error
-                    print(f"Warning: Reply with reply_id {reply['code']} already exists, skipping insert.")
-                else:
-                    raise  # Raise other errors
+        reply_rows = [
+            (reply["code"], (
+                thread["code"],  # 這裡應該是回覆所對應的貼文 ID
+                reply["username"],
+                reply["code"],  # 這是回覆的 ID
+                reply["text"],
+                reply["url"],
+                now
+            ))
+            for thread in threads_data
+            for reply in thread.get("replies", [])
+        ]
+        inserted_ids["replies"] = _insert_new_rows(cursor, "replies", "reply_id", reply_rows, """
+            INSERT INTO replies (post_id, username, reply_id, reply_text, reply_url, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """)
 
-    # 提交資料並關閉連線
-    conn.commit()
-    cursor.close()
-    conn.close()
+        # 同一個交易內更新各帳號的統計彙總
+        record_inserted_rows(cursor, "posts", inserted_ids["posts"])
+        record_inserted_rows(cursor, "replies", inserted_ids["replies"])
+
+        # 提交資料
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        db_pool.release(conn)
+
+    print(f"✅ 新增 {len(inserted_ids['posts'])} 篇貼文、{len(inserted_ids['replies'])} 則回覆")
+    return inserted_ids
+
+
+# 增量爬取：記錄每個帳號上次爬取的時間，以及每篇貼文上次看到的回覆數
+# crawl_state / crawl_threads 資料表由 app.models.schema 建立
+def load_crawl_state(username: str):
+    """Return {"seconds_since_crawl": ..., "threads": {code: reply_count}}, or None if never crawled."""
+    with db_pool.connection() as conn:
+        with _cursor(conn) as cursor:
+            cursor.execute(
+                "SELECT TIMESTAMPDIFF(SECOND, last_crawled_at, NOW()) FROM crawl_state WHERE username = %s",
+                (username,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("SELECT post_code, reply_count FROM crawl_threads WHERE username = %s", (username,))
+            threads = {code: reply_count for code, reply_count in cursor.fetchall()}
+        return {"seconds_since_crawl": row[0], "threads": threads}
+
+
+def save_crawl_state(username: str, threads_data: list, fetched_codes: list) -> None:
+    """Record the crawl time and the reply counts of the threads whose replies were fetched."""
+    fetched_codes = set(fetched_codes)
+    rows = [
+        (thread["code"], username, thread.get("reply_count"))
+        for thread in threads_data
+        if thread["code"] in fetched_codes
+    ]
+    with db_pool.connection() as conn:
+        with _cursor(conn) as cursor:
+            cursor.execute("""
+                INSERT INTO crawl_state (username, last_crawled_at) VALUES (%s, NOW())
+                ON DUPLICATE KEY UPDATE last_crawled_at = VALUES(last_crawled_at)
+            """, (username,))
+            cursor.execute("SELECT NOW()")
+            now = cursor.fetchone()[0]
+            for chunk in _chunks(rows):
+                cursor.executemany("""
+                    INSERT INTO crawl_threads (post_code, username, reply_count, replies_crawled_at)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE reply_count = VALUES(reply_count),
+                        replies_crawled_at = VALUES(replies_crawled_at)
+                """, [row + (now,) for row in chunk])
+        conn.commit()
 
 
 # 3. 解析 Profile 資料
+# JMESPath 運算式在模組載入時編譯一次，避免每筆資料重新解析字串
+PROFILE_EXPRESSION = jmespath.compile(
+    """{
+    is_private: text_post_app_is_private,
+    is_verified: is_verified,
+    profile_pic: hd_profile_pic_versions[-1].url,
+    username: username,
+    full_name: full_name,
+    bio: biography,
+    bio_links: bio_links[].url,
+    followers: follower_count
+}"""
+)
+
+
 def parse_profile(data: Dict) -> Dict:
-    result = jmespath.search(
-        """{
-        is_private: text_post_app_is_private,
-        is_verified: is_verified,
-        profile_pic: hd_profile_pic_versions[-1].url,
-        username: username,
-        full_name: full_name,
-        bio: biography,
-        bio_links: bio_links[].url,
-        followers: follower_count
-    }""",
-        data,
-    )
+    result = PROFILE_EXPRESSION.search(data)
     result["url"] = f"https://www.threads.net/@{result['username']}"
     return result
 
 
 
 # 4. 解析 Thread 資料
-def parse_thread(data: Dict) -> Dict:
-    result = jmespath.search(
-        """{
-        text: post.caption.text,
-        published_on: post.taken_at,
-        id: post.id,
-        pk: post.pk,
-        code: post.code,
-        username: post.user.username,
-        user_pic: post.user.profile_pic_url,
-        user_verified: post.user.is_verified,
-        user_pk: post.user.pk,
-        user_id: post.user.id,
-        has_audio: post.has_audio,
-        reply_count: view_replies_cta_string,
-        like_count: post.like_count,
-        images: post.carousel_media[].image_versions2.candidates[1].url,
-        image_count: post.carousel_media_count,
-        videos: post.video_versions[].url
-    }""",
-        data,
-    )
+THREAD_EXPRESSION = jmespath.compile(
+    """{
+    text: post.caption.text,
+    published_on: post.taken_at,
+    id: post.id,
+    pk: post.pk,
+    code: post.code,
+    username: post.user.username,
+    user_pic: post.user.profile_pic_url,
+    user_verified: post.user.is_verified,
+    user_pk: post.user.pk,
+    user_id: post.user.id,
+    has_audio: post.has_audio,
+    reply_count: view_replies_cta_string,
+    like_count: post.like_count,
+    images: post.carousel_media[].image_versions2.candidates[1].url,
+    image_count: post.carousel_media_count,
+    videos: post.video_versions[].url
+}"""
+)
+
+# 精簡模式：只取會寫進資料庫的欄位，以及增量爬取需要的回覆數
+THREAD_LEAN_EXPRESSION = jmespath.compile(
+    """{
+    text: post.caption.text,
+    code: post.code,
+    username: post.user.username,
+    reply_count: view_replies_cta_string
+}"""
+)
+
+
+def _parse_reply_count(value):
+    # "12 replies"、"1,234 replies"；"1.2K replies" 這類縮寫不是精確值，回覆增加時可能不變，
+    # 與無法解析的字串一樣回傳 None（視為未知，下次一定重新爬取）
+    if not value or type(value) == int:
+        return value
+    try:
+        return int(value.split(" ")[0].replace(",", ""))
+    except ValueError:
+        return None
+
+
+def parse_thread(data: Dict, lean: bool = True) -> Dict:
+    if lean:
+        result = THREAD_LEAN_EXPRESSION.search(data)
+        result["reply_count"] = _parse_reply_count(result["reply_count"])
+        result["url"] = f"https://www.threads.net/@{result['username']}/post/{result['code']}"
+        return result
+
+    result = THREAD_EXPRESSION.search(data)
     result["videos"] = list(set(result["videos"] or []))
-    if result["reply_count"] and type(result["reply_count"]) != int:
-        result["reply_count"] = int(result["reply_count"].split(" ")[0])
+    result["reply_count"] = _parse_reply_count(result["reply_count"])
     result["url"] = f"https://www.threads.net/@{result['username']}/post/{result['code']}"
-    
-    # 保留必要欄位
-    keys_to_keep = ["text", "code", "username", "url"]
-    filtered_result = {key: result[key] for key in keys_to_keep if key in result}
-    return filtered_result
+    return result
 
 
 # 5. 爬取 Thread 資料
-def scrape_thread(url: str, expected_code: str, context=None) -> dict:
-    if context is None:
-        with sync_playwright() as pw:
-            browser = pw.chromium.launch()
-            context = browser.new_context(viewport={"width": 1920, "height": 1080})
-            page = context.new_page()
-            result = _scrape_thread(page, url, expected_code)
-            browser.close()
-            return result
-    else:
-        page = context.new_page()
-        return _scrape_thread(page, url, expected_code)
-
-
-def _scrape_thread(page, url: str, expected_code: str) -> dict:
+async def _scrape_thread_async(page, url: str, expected_code: str, metrics: dict = None) -> dict:
+    responses = await _load_page(page, url, metrics)
+    datasets = await _page_datasets(page, responses, ("thread_items",))
+    return _select_thread(datasets, expected_code)
+
+
+def _html_datasets(html: str) -> list:
+    selector = Selector(html)
+    hidden_datasets = selector.css(f'{SJS_SCRIPT_SELECTOR}::text').getall()
+    return [dataset for dataset in hidden_datasets if '"ScheduledServerJS"' in dataset]
+
+
+def _load_dataset(dataset: str):
+    # GraphQL 回應可能帶有 "for (;;);" 之類的前綴
+    start = dataset.find("{")
+    try:
+        return json.loads(dataset[start:] if start > 0 else dataset)
+    except json.JSONDecodeError as e:
+        print(f"Debug: Skipping malformed JSON dataset: {e}")
+        return None
+
+
+async def _page_datasets(page, responses: list, markers: tuple) -> list:
+    """Return the JSON blobs on a loaded page that may contain the given markers."""
+    if CRAWL_EXTRACT_MODE == "html":
+        return _html_datasets(await page.content())
+
+    datasets = await page.eval_on_selector_all(SJS_SCRIPT_SELECTOR, _SELECT_SJS_SCRIPTS, list(markers))
+    for response in responses:
+        try:
+            body = await response.text()
+        except Exception as e:
+            print(f"Debug: Could not read response {response.url}: {e}")
+            continue
+        if any(marker in body for marker in markers):
+            datasets.append(body)
+    return datasets
+
+
+def _new_crawl_metrics() -> dict:
+    return {"requests": 0, "blocked": 0, "bytes": 0, "pages": 0, "load_seconds": 0.0}
+
+
+def _host_allowed(host: str) -> bool:
+    if not CRAWL_ALLOWED_HOSTS:
+        return True
+    return any(host == allowed or host.endswith("." + allowed) for allowed in CRAWL_ALLOWED_HOSTS)
+
+
+async def install_request_filter(context, metrics: dict, block: bool = CRAWL_BLOCK_RESOURCES) -> None:
+    """Abort unneeded resource types and third-party hosts, and record transferred bytes."""
+    async def on_request_finished(request):
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            return
+        metrics["requests"] += 1
+        metrics["bytes"] += max(sizes["responseBodySize"], 0) + max(sizes["responseHeadersSize"], 0)
+
+    context.on("requestfinished", on_request_finished)
+    if not block:
+        return
+
+    async def filter_request(route, request):
+        host = urlparse(request.url).hostname or ""
+        if request.resource_type in CRAWL_BLOCKED_RESOURCE_TYPES or not _host_allowed(host):
+            metrics["blocked"] += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route("**/*", filter_request)
+
+
+async def _load_page(page, url: str, metrics: dict = None) -> list:
+    """Navigate to url and return the GraphQL/XHR responses received while it loaded."""
     print(f"Debug: Visiting URL: {url}")
-    page.goto(url)
-    page.wait_for_selector("[data-pressable-container=true]")
-    selector = Selector(page.content())
-    hidden_datasets = selector.css('script[type="application/json"][data-sjs]::text').getall()
+    responses = []
+
+    def capture(response):
+        if response.request.resource_type in ("xhr", "fetch") and "graphql" in response.url:
+            responses.append(response)
+
+    if CRAWL_EXTRACT_MODE != "html":
+        page.on("response", capture)
+    start_time = time.perf_counter()
+    try:
+        await page.goto(url)
+        await page.wait_for_selector("[data-pressable-container=true]")
+    finally:
+        if CRAWL_EXTRACT_MODE != "html":
+            page.remove_listener("response", capture)
+    if metrics is not None:
+        metrics["pages"] += 1
+        metrics["load_seconds"] += time.perf_counter() - start_time
+    return responses
+
+
+def _report_crawl_metrics(username: str, metrics: dict) -> None:
+    average = metrics["load_seconds"] / metrics["pages"] if metrics["pages"] else 0.0
+    print(
+        f"📊 {username}：{metrics['pages']} 個頁面，{metrics['requests']} 個請求"
+        f"（擋下 {metrics['blocked']} 個），下載 {metrics['bytes'] / (1024 * 1024):.2f} MB，"
+        f"平均載入 {average:.2f}s（過濾{'開啟' if CRAWL_BLOCK_RESOURCES else '關閉'}）"
+    )
+
+
+def _select_thread(hidden_datasets: list, expected_code: str) -> dict:
     for hidden_dataset in hidden_datasets:
-        if '"ScheduledServerJS"' not in hidden_dataset or "thread_items" not in hidden_dataset:
+        if "thread_items" not in hidden_dataset:
+            continue
+        data = _load_dataset(hidden_dataset)
+        if data is None:
             continue
-        data = json.loads(hidden_dataset)
         thread_items = nested_lookup("thread_items", data)
         if not thread_items:
             continue
@@ -226,60 +451,156 @@ def _scrape_thread(page, url: str, expected_code: str) -> dict:
             print(f"Debug: No thread found with code {expected_code}")
     raise ValueError("could not find thread data in page")
 
-# 6. 爬取 Profile 資料
-def scrape_profile(username: str) -> dict:
+
+def _thread_url(thread_code: str) -> str:
+    return f"https://www.threads.net/t/{thread_code}/"
+
+
+async def scrape_replies_async(threads: list, context, concurrency: int = CRAWL_CONCURRENCY,
+                               per_host_concurrency: int = CRAWL_PER_HOST_CONCURRENCY,
+                               metrics: dict = None) -> list:
+    """Fetch replies for all threads in parallel over a bounded pool of reusable pages.
+
+    Returns the codes of the threads whose replies were fetched successfully.
+    """
+    fetched_codes = []
+    if not threads:
+        return fetched_codes
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host_concurrency))
+
+    pages = asyncio.Queue()
+    for _ in range(min(max(concurrency, 1), len(threads))):
+        pages.put_nowait(await context.new_page())
+
+    async def fetch(thread):
+        thread_code = thread["code"]
+        thread_url = _thread_url(thread_code)
+        async with host_limits[urlparse(thread_url).netloc]:
+            page = await pages.get()
+            try:
+                thread_data = await _scrape_thread_async(page, thread_url, thread_code, metrics)
+                thread["replies"] = thread_data["replies"]
+                fetched_codes.append(thread_code)
+            except Exception as e:
+                print(f"Error scraping replies for {thread_code}: {e}")
+                thread["replies"] = []
+            finally:
+                if page.is_closed():
+                    page = await context.new_page()
+                pages.put_nowait(page)
+
+    await asyncio.gather(*(fetch(thread) for thread in threads))
+    while not pages.empty():
+        await pages.get_nowait().close()
+    return fetched_codes
+
+
+def _collect_profile(hidden_datasets: list, parsed: dict) -> None:
+    seen_codes = {thread["code"] for thread in parsed['threads']}
+    for hidden_dataset in hidden_datasets:
+        is_profile = 'follower_count' in hidden_dataset
+        is_threads = 'thread_items' in hidden_dataset
+        if not is_profile and not is_threads:
+            continue
+        data = _load_dataset(hidden_dataset)
+        if data is None:
+            continue
+        if is_profile:
+            # GraphQL 回應裡的貼文作者也叫 user，只取帶有 follower_count 的個人檔案
+            user_data = [user for user in nested_lookup('user', data) if isinstance(user, dict) and 'follower_count' in user]
+            if user_data:
+                parsed['user'] = parse_profile(user_data[0])
+        if is_threads:
+            thread_items = nested_lookup('thread_items', data)
+            threads = [parse_thread(t) for thread in thread_items for t in thread]
+            # 同一篇貼文可能同時出現在 data-sjs 與 GraphQL 回應中
+            for thread in threads:
+                if thread["code"] not in seen_codes:
+                    seen_codes.add(thread["code"])
+                    parsed['threads'].append(thread)
+
+
+async def scrape_profile_async(username: str, concurrency: int = CRAWL_CONCURRENCY,
+                               known_threads: dict = None) -> dict:
+    """Crawl a profile and its replies with a context borrowed from the warm browser pool.
+
+    known_threads maps post codes to the reply count seen on the last crawl;
+    threads whose reply count has not changed are not revisited.
+    """
     parsed = {
         "user": {},
         "threads": [],
     }
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch()
-        context = browser.new_context(viewport={"width": 1920, "height": 1080})
-        page = context.new_page()
+    metrics = _new_crawl_metrics()
+    async with browser_pool.context() as context:
+        await install_request_filter(context, metrics)
+        page = await context.new_page()
         profile_url = f"https://www.threads.net/@{username}"
-        print(f"Debug: Visiting profile URL: {profile_url}")
-        page.goto(profile_url)
-        page.wait_for_selector("[data-pressable-container=true]")
-        selector = Selector(page.content())
-        hidden_datasets = selector.css('script[type="application/json"][data-sjs]::text').getall()
-        for hidden_dataset in hidden_datasets:
-            if '"ScheduledServerJS"' not in hidden_dataset:
-                continue
-            is_profile = 'follower_count' in hidden_dataset
-            is_threads = 'thread_items' in hidden_dataset
-            if not is_profile and not is_threads:
-                continue
-            data = json.loads(hidden_dataset)
-            if is_profile:
-                user_data = nested_lookup('user', data)
-                parsed['user'] = parse_profile(user_data[0])
-            if is_threads:
-                thread_items = nested_lookup('thread_items', data)
-                threads = [parse_thread(t) for thread in thread_items for t in thread]
-                parsed['threads'].extend(threads)
-        
-        # 取得每篇貼文的回覆
+        try:
+            responses = await _load_page(page, profile_url, metrics)
+            datasets = await _page_datasets(page, responses, ("follower_count", "thread_items"))
+            _collect_profile(datasets, parsed)
+        finally:
+            await page.close()
+
+        # 只重新爬取新貼文或回覆數有變動的貼文，其餘回覆已在資料庫中
+        known_threads = known_threads or {}
+        changed = []
         for thread in parsed['threads']:
-            thread_code = thread["code"]
-            thread_url = f"https://www.threads.net/t/{thread_code}/"
-            print(f"Debug: Scraping thread URL: {thread_url}")
-            try:
-                thread_data = scrape_thread(thread_url, thread_code, context=context)
-                thread["replies"] = thread_data["replies"]
-            except Exception as e:
-                print(f"Error scraping replies for {thread_code}: {e}")
+            # 回覆數未知（None）時無法判斷是否有變動，一律重新爬取
+            previous = known_threads.get(thread["code"])
+            if previous is not None and previous == thread.get("reply_count"):
                 thread["replies"] = []
-        
-        browser.close()
-    
-    # 儲存資料到資料庫
-    save_to_db(parsed["user"], parsed["threads"])
+            else:
+                changed.append(thread)
+        if known_threads:
+            print(f"Debug: {len(parsed['threads']) - len(changed)} threads unchanged since last crawl, skipping replies.")
+
+        # 取得每篇貼文的回覆（concurrency=1 時逐篇爬取）
+        parsed["fetched_codes"] = await scrape_replies_async(changed, context, concurrency, metrics=metrics)
+
+    _report_crawl_metrics(username, metrics)
+    parsed["metrics"] = metrics
+    return parsed
+
+
+# 6. 爬取 Profile 資料
+async def crawl_profile(username: str, concurrency: int = CRAWL_CONCURRENCY,
+                        incremental: bool = CRAWL_INCREMENTAL) -> dict:
+    """Crawl a profile and store it; must run on the browser pool loop.
+
+    Database calls run in worker threads so the loop keeps serving other crawls.
+    """
+    state = await asyncio.to_thread(load_crawl_state, username) if incremental else None
+    if state and state["seconds_since_crawl"] < CRAWL_REFRESH_INTERVAL:
+        print(f"Debug: {username} was crawled {state['seconds_since_crawl']:.0f}s ago, skipping crawl.")
+        return {
+            "user": {},
+            "threads": [],
+            "inserted_ids": {"posts": [], "replies": []},
+            "skipped": True,
+        }
+
+    known_threads = state["threads"] if state else None
+    parsed = await scrape_profile_async(username, concurrency, known_threads)
+
+    # 儲存資料到資料庫，並記下這次新增的資料列 id 供後續預測使用
+    parsed["inserted_ids"] = await asyncio.to_thread(save_to_db, parsed["user"], parsed["threads"])
+    if incremental:
+        await asyncio.to_thread(save_crawl_state, username, parsed["threads"], parsed["fetched_codes"])
     return parsed
 
 
+def scrape_profile(username: str, concurrency: int = CRAWL_CONCURRENCY,
+                   incremental: bool = CRAWL_INCREMENTAL) -> dict:
+    """Blocking wrapper around crawl_profile for callers outside the browser loop."""
+    return browser_pool.run(crawl_profile, username, concurrency, incremental)
+
+
 if __name__ == "__main__":
     print("開始測試資料庫連接...")
     test_db_connection()  # 測試資料庫連接
+    migrate()  # 建立或更新資料表
     print("根據 Threads 使用者名稱抓取所有貼文與回覆")
     username = input("your_username_here : ")
     user_data = scrape_profile(username)
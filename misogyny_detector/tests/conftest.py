@@ -0,0 +1,40 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# 測試以 misogyny_detector/ 為根目錄匯入 app 套件
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mysql_conn():
+    """
+    連到 TEST_MYSQL_HOST 上的 MySQL / MariaDB，建立一個用完即刪的資料庫
+    沒有設定 TEST_MYSQL_HOST 時略過（例如：docker run -e MARIADB_ALLOW_EMPTY_ROOT_PASSWORD=1 -p 3306:3306 mariadb）
+    """
+    pymysql = pytest.importorskip("pymysql")
+    host = os.getenv("TEST_MYSQL_HOST")
+    if not host:
+        pytest.skip("設定 TEST_MYSQL_HOST 以執行需要 MySQL/MariaDB 的測試")
+
+    params = dict(
+        host=host,
+        port=int(os.getenv("TEST_MYSQL_PORT", 3306)),
+        user=os.getenv("TEST_MYSQL_USER", "root"),
+        password=os.getenv("TEST_MYSQL_PASSWORD", ""),
+        charset="utf8mb4",
+    )
+    database = f"misogyny_test_{uuid.uuid4().hex[:8]}"
+    admin = pymysql.connect(autocommit=True, **params)
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE {database} DEFAULT CHARSET utf8mb4")
+    conn = pymysql.connect(database=database, cursorclass=pymysql.cursors.DictCursor, **params)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE {database}")
+        admin.close()
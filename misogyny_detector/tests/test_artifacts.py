@@ -0,0 +1,146 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+pytest.importorskip("flask")  # app 套件的 __init__ 匯入 Flask
+
+from app.models import artifacts
+from app.models.artifacts import ArtifactError, ensure_model
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+BUCKET = "test-models"
+PREFIX = "bert"
+FILES = {"config.json": b'{"num_labels": 2}', "vocab.txt": b"[PAD]\n[UNK]\n", "weights.bin": os.urandom(4096)}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _upload(client, version, files=FILES, manifest_overrides=None):
+    entries = []
+    for path, body in files.items():
+        client.put_object(Bucket=BUCKET, Key=f"{PREFIX}/{path}", Body=body)
+        entry = {"path": path, "size": len(body), "sha256": hashlib.sha256(body).hexdigest()}
+        entry.update((manifest_overrides or {}).get(path, {}))
+        entries.append(entry)
+    manifest = {"version": version, "files": entries}
+    client.put_object(Bucket=BUCKET, Key=f"{PREFIX}/manifest.json", Body=json.dumps(manifest).encode())
+
+
+def _leftovers(cache_dir):
+    return [name for name in os.listdir(cache_dir) if not name.endswith(".lock")]
+
+
+def test_clean_download(s3, tmp_path):
+    _upload(s3, "v1")
+    target = ensure_model(BUCKET, PREFIX, str(tmp_path), s3)
+
+    assert target == os.path.join(str(tmp_path), "v1")
+    for path, body in FILES.items():
+        with open(os.path.join(target, path), "rb") as f:
+            assert f.read() == body
+    assert _leftovers(str(tmp_path)) == ["v1"]
+    # 已完成的版本直接使用，不再下載
+    assert ensure_model(BUCKET, PREFIX, str(tmp_path), s3) == target
+
+
+def test_checksum_mismatch_leaves_no_version_dir(s3, tmp_path):
+    _upload(s3, "v1", manifest_overrides={"weights.bin": {"sha256": "0" * 64}})
+
+    with pytest.raises(ArtifactError):
+        ensure_model(BUCKET, PREFIX, str(tmp_path), s3)
+
+    assert not os.path.exists(os.path.join(str(tmp_path), "v1"))
+    # 暫存目錄也必須清掉
+    assert _leftovers(str(tmp_path)) == []
+
+
+def test_falls_back_to_newest_complete_version(s3, tmp_path):
+    _upload(s3, "v1")
+    old = ensure_model(BUCKET, PREFIX, str(tmp_path), s3)
+    _upload(s3, "v2")
+    new = ensure_model(BUCKET, PREFIX, str(tmp_path), s3)
+    os.utime(old, (time.time() - 60, time.time() - 60))
+
+    # S3 上的模型被移除（或無法讀取）時使用本機最新的完整版本
+    for obj in s3.list_objects_v2(Bucket=BUCKET)["Contents"]:
+        s3.delete_object(Bucket=BUCKET, Key=obj["Key"])
+    assert ensure_model(BUCKET, PREFIX, str(tmp_path), s3) == new
+
+
+def test_concurrent_workers_download_once(s3, tmp_path):
+    _upload(s3, "v1")
+    downloads = []
+    download_file = s3.download_file
+
+    def counting_download(*args, **kwargs):
+        downloads.append(args[1])
+        # 拉長下載時間，讓另一個 worker 一定在鎖上等待
+        time.sleep(0.2)
+        return download_file(*args, **kwargs)
+
+    s3.download_file = counting_download
+    barrier = threading.Barrier(2)
+    results, errors = [], []
+
+    def worker():
+        barrier.wait()
+        try:
+            results.append(ensure_model(BUCKET, PREFIX, str(tmp_path), s3))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [os.path.join(str(tmp_path), "v1")] * 2
+    assert sorted(downloads) == sorted(f"{PREFIX}/{path}" for path in FILES)
+
+
+def test_single_archive_prefix(s3, tmp_path):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for path, body in FILES.items():
+            info = tarfile.TarInfo(f"model/{path}")
+            info.size = len(body)
+            archive.addfile(info, io.BytesIO(body))
+    key = "models/bert.tar.gz"
+    s3.put_object(Bucket=BUCKET, Key=key, Body=buffer.getvalue())
+
+    target = ensure_model(BUCKET, key, str(tmp_path), s3)
+
+    assert os.path.basename(target).startswith("bert.tar.gz-")
+    for path, body in FILES.items():
+        with open(os.path.join(target, path), "rb") as f:
+            assert f.read() == body
+    assert not os.path.exists(os.path.join(target, "bert.tar.gz"))
+
+
+def test_missing_prefix_without_cache_raises(s3, tmp_path):
+    with pytest.raises(ArtifactError):
+        ensure_model(BUCKET, "missing", str(tmp_path), s3)
+    assert artifacts._latest_complete(str(tmp_path)) is None
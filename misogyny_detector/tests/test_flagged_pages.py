@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from app.models import detector
+from app.models.schema import migrate
+
+
+def _flag(conn, rows):
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO posts (username, post_id, post_text, is_misogyny, confidence, created_at) "
+            "VALUES (%s, %s, %s, 1, %s, NOW())",
+            rows
+        )
+    conn.commit()
+
+
+def _all_pages(conn, username, order, limit):
+    seen = []
+    cursor = None
+    for _ in range(100):
+        items, cursor = detector.get_misogynistic_texts_page(conn, username, order, cursor, limit)
+        seen.extend(item['id'] for item in items)
+        if cursor is None:
+            return seen
+    pytest.fail("分頁沒有結束（同一頁重複出現）")
+
+
+def test_tied_confidences_page_without_repeats_or_gaps(mysql_conn):
+    migrate(mysql_conn)
+    # 模型輸出的 float32 機率；預測快取讓重複的文字得到完全相同的信心度
+    confidence = 0.9876543283462524
+    _flag(mysql_conn, [("alice", f"p{i}", f"text {i}", confidence) for i in range(12)])
+    _flag(mysql_conn, [("alice", "top", "top", 0.99), ("alice", "low", "low", 0.51), ("bob", "other", "x", confidence)])
+
+    with mysql_conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM posts WHERE username = 'alice'")
+        expected = {row['id'] for row in cursor.fetchall()}
+
+    for order in detector.FLAGGED_ORDERS:
+        seen = _all_pages(mysql_conn, "alice", order, limit=5)
+        assert len(seen) == len(set(seen))
+        assert set(seen) == expected
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15)
+    item = {'confidence': 0.75, 'created_at': created_at, 'rank': 1, 'id': 42}
+    assert detector.decode_flagged_cursor(detector.encode_flagged_cursor(item, 'confidence'), 'confidence') == (0.75, 1, 42)
+    assert detector.decode_flagged_cursor(detector.encode_flagged_cursor(item, 'created_at'), 'created_at') == (created_at, 1, 42)
+
+
+@pytest.mark.parametrize("payload, column", [
+    (["confidence", [1, 2], 0, 1], 'confidence'),
+    (["confidence", {"a": 1}, 0, 1], 'confidence'),
+    (["confidence", "2024-05-01T12:00:00", 0, 1], 'confidence'),
+    (["created_at", 0.5, 0, 1], 'created_at'),
+    (["created_at", "not a date", 0, 1], 'created_at'),
+    (["confidence", 0.5, 0, 1], 'created_at'),
+    (["confidence", 0.5, 7, 1], 'confidence'),
+    (["confidence", 0.5, 0, "1"], 'confidence'),
+    ([0.5, 0, 1], 'confidence'),
+])
+def test_invalid_cursor_is_rejected(payload, column):
+    cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+    with pytest.raises(ValueError):
+        detector.decode_flagged_cursor(cursor, column)
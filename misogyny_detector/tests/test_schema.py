@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+pytest.importorskip("flask")  # app 套件的 __init__ 匯入 Flask
+pytest.importorskip("pymysql")
+pytest.importorskip("dotenv")
+
+from app.models.schema import MIGRATIONS, _indexes, check_query_plans, current_version, migrate
+
+
+def _fill(conn, users=40, per_user=250):
+    """
+    接近正式環境的資料分布：大部分已預測、少數待預測，約一成為厭女文
+    HOT_QUERIES 的參數（帳號 'x'、代碼 'a' / 'b'）也對應到實際的資料列
+    """
+    rng = random.Random(0)
+    usernames = ['x'] + [f"user{i}" for i in range(users - 1)]
+    posts, replies = [], []
+    for username in usernames:
+        for i in range(per_user):
+            roll = rng.random()
+            label = None if roll < 0.03 else 1 if roll < 0.13 else 0
+            confidence = None if label is None else rng.random()
+            code = f"{username}-{i}"
+            posts.append((username, code, f"post {code}", label, confidence))
+            replies.append((code, username, f"r-{code}", f"reply {code}", label, confidence))
+    posts[:2] = [('x', code, 'post', 0, 0.1) for code in ('a', 'b')]
+    replies[:2] = [('a', 'x', code, 'reply', 0, 0.1) for code in ('a', 'b')]
+
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO posts (username, post_id, post_text, is_misogyny, confidence, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, NOW())",
+            posts
+        )
+        cursor.executemany(
+            "INSERT INTO replies (post_id, username, reply_id, reply_text, is_misogyny, confidence, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, NOW())",
+            replies
+        )
+        cursor.execute("ANALYZE TABLE posts, replies")
+        cursor.fetchall()
+    conn.commit()
+
+
+def test_migrate_is_idempotent(mysql_conn):
+    assert migrate(mysql_conn) == [number for number, _, _ in MIGRATIONS]
+    assert migrate(mysql_conn) == []
+    assert current_version(mysql_conn) == MIGRATIONS[-1][0]
+
+
+def test_hot_queries_use_their_indexes(mysql_conn):
+    migrate(mysql_conn)
+    _fill(mysql_conn)
+
+    failed = [result for result in check_query_plans(mysql_conn) if not result[-1]]
+    assert failed == []
+
+
+def test_legacy_unique_key_is_not_duplicated(mysql_conn):
+    # 手動建立的舊資料表，唯一索引名稱與 migration 不同
+    with mysql_conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE posts (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(255) NOT NULL,
+                post_id VARCHAR(64) NOT NULL,
+                post_text TEXT NULL,
+                post_url VARCHAR(512) NULL,
+                created_at DATETIME NULL,
+                is_misogyny TINYINT(1) NULL,
+                confidence FLOAT NULL,
+                UNIQUE KEY post_id (post_id)
+            ) DEFAULT CHARSET = utf8mb4
+        """)
+    mysql_conn.commit()
+
+    migrate(mysql_conn)
+
+    with mysql_conn.cursor() as cursor:
+        indexes = _indexes(cursor, 'posts')
+    assert [name for name, (columns, _) in indexes.items() if columns == ('post_id',)] == ['post_id']
+    assert indexes['post_id'][1]
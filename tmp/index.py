@@ -4,7 +4,6 @@ from nested_lookup import nested_lookup
 from parsel import Selector
 from typing import Dict
 import jmespath
-import pymysql
 import json
 from database.db import connect_to_db
 
@@ -12,87 +11,121 @@ app = Flask(__name__)
 
 # ===== 資料處理與資料庫儲存 =====
 
+SAVE_CHUNK_SIZE = 500
+
+def _ids_by_code(cursor, table, code_column, codes):
+    found = {}
+    for start in range(0, len(codes), SAVE_CHUNK_SIZE):
+        chunk = codes[start:start + SAVE_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"SELECT id, {code_column} FROM {table} WHERE {code_column} IN ({placeholders})", chunk)
+        found.update({row[code_column]: row["id"] for row in cursor.fetchall()})
+    return found
+
+def _insert_new_rows(cursor, table, code_column, rows, insert_query):
+    # rows: [(code, params), ...]，只插入資料庫中還沒有的 code，回傳新資料列的 id
+    unique_rows = {}
+    for code, params in rows:
+        unique_rows.setdefault(code, params)
+
+    existing = _ids_by_code(cursor, table, code_column, list(unique_rows))
+    new_codes = [code for code in unique_rows if code not in existing]
+    for start in range(0, len(new_codes), SAVE_CHUNK_SIZE):
+        chunk = new_codes[start:start + SAVE_CHUNK_SIZE]
+        cursor.executemany(insert_query, [unique_rows[code] for code in chunk])
+
+    new_ids = _ids_by_code(cursor, table, code_column, new_codes)
+    return [new_ids[code] for code in new_codes if code in new_ids]
+
+def _record_inserted_rows(cursor, table, ids):
+    # 與 app.models.user_stats.record_inserted_rows 相同：把新資料列加進 user_stats 的總數
+    for start in range(0, len(ids), SAVE_CHUNK_SIZE):
+        chunk = ids[start:start + SAVE_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"""
+            INSERT INTO user_stats (username, {table}_total)
+            SELECT username, COUNT(*) FROM {table} WHERE id IN ({placeholders}) GROUP BY username
+            ON DUPLICATE KEY UPDATE {table}_total = {table}_total + VALUES({table}_total)
+        """, chunk)
+
 def save_to_db(user_data: dict, posts_data: list, replies_data: list):
     conn = connect_to_db()
     cursor = conn.cursor()
+    inserted_ids = {"posts": [], "replies": []}
     try:
-        cursor.execute("""
-            INSERT INTO profiles (username, full_name, bio, followers, url)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (user_data["username"], user_data["full_name"], user_data["bio"], user_data["followers"], user_data["url"]))
-    except pymysql.MySQLError as e:
-        if e.args[0] != 1062:
-            raise
-
-    for post in posts_data:
-        if not post.get("text"):
-            continue
-        try:
-            cursor.execute("""
-                INSERT INTO posts (username, post_id, post_text, post_url, created_at)
-                VALUES (%s, %s, %s, %s, NOW())
-            """, (post["username"], post["code"], post["text"], post["url"]))
-        except pymysql.MySQLError as e:
-            if e.args[0] != 1062:
-                raise
-
-    for reply in replies_data:
-        if not reply.get("text"):
-            continue
-        try:
-            cursor.execute("""
-                INSERT INTO replies (post_id, username, reply_id, reply_text, reply_url, created_at)
-                VALUES (%s, %s, %s, %s, %s, NOW())
-            """, (reply.get("post_id", reply["code"]), reply["username"], reply["code"], reply["text"], reply["url"]))
-        except pymysql.MySQLError as e:
-            if e.args[0] != 1062:
-                raise
+        cursor.execute("SELECT NOW() AS now")
+        now = cursor.fetchone()["now"]
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        if user_data:
+            cursor.execute("""
+                INSERT INTO profiles (username, full_name, bio, followers, url)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE full_name = VALUES(full_name), bio = VALUES(bio),
+                    followers = VALUES(followers), url = VALUES(url)
+            """, (user_data["username"], user_data["full_name"], user_data["bio"], user_data["followers"], user_data["url"]))
+
+        post_rows = [
+            (post["code"], (post["username"], post["code"], post["text"], post["url"], now))
+            for post in posts_data if post.get("text")
+        ]
+        inserted_ids["posts"] = _insert_new_rows(cursor, "posts", "post_id", post_rows, """
+            INSERT INTO posts (username, post_id, post_text, post_url, created_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """)
+
+        reply_rows = [
+            (reply["code"], (reply.get("post_id", reply["code"]), reply["username"], reply["code"], reply["text"], reply["url"], now))
+            for reply in replies_data if reply.get("text")
+        ]
+        inserted_ids["replies"] = _insert_new_rows(cursor, "replies", "reply_id", reply_rows, """
+            INSERT INTO replies (post_id, username, reply_id, reply_text, reply_url, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """)
+
+        # 彙總表與新資料在同一個交易內更新
+        for table, ids in inserted_ids.items():
+            _record_inserted_rows(cursor, table, ids)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return inserted_ids
+
+PROFILE_EXPRESSION = jmespath.compile(
+    """{
+    is_private: text_post_app_is_private,
+    is_verified: is_verified,
+    profile_pic: hd_profile_pic_versions[-1].url,
+    username: username,
+    full_name: full_name,
+    bio: biography,
+    bio_links: bio_links[].url,
+    followers: follower_count
+}""")
+
+# 只取會寫進資料庫的欄位
+THREAD_EXPRESSION = jmespath.compile(
+    """{
+    text: post.caption.text,
+    code: post.code,
+    username: post.user.username
+}""")
 
 def parse_profile(data: Dict) -> Dict:
-    result = jmespath.search(
-        """{
-        is_private: text_post_app_is_private,
-        is_verified: is_verified,
-        profile_pic: hd_profile_pic_versions[-1].url,
-        username: username,
-        full_name: full_name,
-        bio: biography,
-        bio_links: bio_links[].url,
-        followers: follower_count
-    }""", data)
+    result = PROFILE_EXPRESSION.search(data)
     result["url"] = f"https://www.threads.net/@{result['username']}"
     return result
 
 def parse_thread(data: Dict) -> Dict:
-    result = jmespath.search(
-        """{
-        text: post.caption.text,
-        published_on: post.taken_at,
-        id: post.id,
-        pk: post.pk,
-        code: post.code,
-        username: post.user.username,
-        user_pic: post.user.profile_pic_url,
-        user_verified: post.user.is_verified,
-        user_pk: post.user.pk,
-        user_id: post.user.id,
-        has_audio: post.has_audio,
-        reply_count: view_replies_cta_string,
-        like_count: post.like_count,
-        images: post.carousel_media[].image_versions2.candidates[1].url,
-        image_count: post.carousel_media_count,
-        videos: post.video_versions[].url
-    }""", data)
-    result["videos"] = list(set(result["videos"] or []))
-    if result["reply_count"] and type(result["reply_count"]) != int:
-        result["reply_count"] = int(result["reply_count"].split(" ")[0])
+    result = THREAD_EXPRESSION.search(data)
     result["url"] = f"https://www.threads.net/@{result['username']}/post/{result['code']}"
-    keys_to_keep = ["text", "code", "username", "url"]
-    return {k: result[k] for k in keys_to_keep if k in result}
+    return result
 
 # ===== Flask API 入口點 =====
 
@@ -163,8 +196,12 @@ def scrape_profile_api():
 
             browser.close()
 
-        save_to_db(parsed["user"], parsed["threads"], parsed["replies"])
-        return jsonify({"status": "done", "user": parsed["user"], "thread_count": len(parsed["threads"]), "reply_count": len(parsed["replies"])})
+        inserted_ids = save_to_db(parsed["user"], parsed["threads"], parsed["replies"])
+        return jsonify({
+            "status": "done", "user": parsed["user"],
+            "thread_count": len(parsed["threads"]), "reply_count": len(parsed["replies"]),
+            "new_thread_count": len(inserted_ids["posts"]), "new_reply_count": len(inserted_ids["replies"])
+        })
 
     except Exception as e:
         return jsonify({"status": "error", "detail": str(e)}), 500